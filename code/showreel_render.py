@@ -2,6 +2,7 @@
 
 
 import argparse
+import functools
 import json
 import os
 import sys
@@ -16,20 +17,21 @@ project_path = os.path.dirname(__file__)
 sys.path.append(project_path)
 
 import utils.blender_util as butil
-# import utils.manifold_util as mfd
+import utils.cache_util as cutil
+import utils.manifold_util as mfd
+import utils.profile_util as putil
+import utils.render_jobs as rjobs
 
+# the inputs of setup_shared_scene, the other asset keys belong to the jobs
+SHARED_ASSET_KEYS = ["plane_file", "bg_file"]
 
-def normalize_object(obj: bpy.types.Object):
-    bbox_min = None
-    bbox_max = None
-    for v in obj.bound_box:
-        v = obj.matrix_world @ Vector(v)
-        bbox_max = np.maximum(bbox_max, v) if bbox_max is not None else v
-        bbox_min = np.minimum(bbox_min, v) if bbox_min is not None else v
-    scale = 1 / max(bbox_max - bbox_min)
-    offset = -(bbox_min + bbox_max) / 2
-    T = Matrix.Diagonal([scale, scale, scale, 1.0]) @ Matrix.Translation(offset)
-    obj.matrix_world = T @ obj.matrix_world
+# bump when a change to this pipeline changes the rendered output, invalidates the render cache
+RENDERER_VERSION = 3
+
+
+def normalize_object(obj: bpy.types.Object, mode: str = "exact") -> np.ndarray:
+    # fit the model (and its children) into the unit cube, returns the applied transform
+    return butil.normalize_objects([obj], mode)
 
 
 def rotate_object_and_set_keyframes(obj, frames=360):
@@ -38,16 +40,65 @@ def rotate_object_and_set_keyframes(obj, frames=360):
     bpy.context.scene.frame_start = 0
     bpy.context.scene.frame_end = frames - 1
 
-    # Rotate and set keyframe for each frame
-    for frame in range(frames):
-        angle = (frame - 1) * (np.pi * 2 / frames)
-        obj.rotation_mode = "XYZ"
-        obj.rotation_euler[2] = angle  # Rotate around Z-axis
-        obj.keyframe_insert(data_path="rotation_euler", frame=frame)
+    # Rotate around Z-axis, one keyframe per frame
+    frame_ids = np.arange(frames)
+    angles = (frame_ids - 1) * (np.pi * 2 / frames)
+    obj.rotation_mode = "XYZ"
+    butil.set_keyframes(obj, "rotation_euler", np.stack([frame_ids, angles], axis=1), index=2)
+
+
+
+def orbit_camera_and_set_keyframes(
+    cam_obj, pivot: Vector, frames=360, lights=None, world_mapping_node=None
+):
+    """
+    The turntable of rotate_object_and_set_keyframes seen from the model: the model stays
+    static and the camera orbits the vertical axis through pivot (the model origin) the
+    other way round. Nothing in the scene changes but the camera, so with persistent data
+    Cycles keeps the BVH and textures of the first frame for the whole sequence.
+    Lights are parented to the camera, the world HDR rotates along.
+    """
+    bpy.ops.object.mode_set(mode="OBJECT")
+    bpy.context.scene.frame_start = 0
+    bpy.context.scene.frame_end = frames - 1
 
+    # the lights keep their pose relative to the camera, as with a rotating model
+    for light_obj in lights or []:
+        light_obj.parent = cam_obj
+        light_obj.matrix_parent_inverse = cam_obj.matrix_world.inverted()
+
+    angles = (np.arange(frames) - 1) * (np.pi * 2 / frames)
+    c, s = np.cos(-angles), np.sin(-angles)
+    rotations = np.zeros((frames, 3, 3))
+    rotations[:, 0, 0], rotations[:, 0, 1] = c, -s
+    rotations[:, 1, 0], rotations[:, 1, 1] = s, c
+    rotations[:, 2, 2] = 1.0
+
+    pivot = np.array([pivot[0], pivot[1], 0.0])
+    location = np.array(cam_obj.matrix_world.translation)
+    target = location - np.array(cam_obj.matrix_world.col[2][:3])  # the camera looks down -Z
+    locations = rotations @ (location - pivot) + pivot
+    targets = rotations @ (target - pivot) + pivot
+    _, quaternions = butil.get_lookat_poses(locations, targets)
+
+    frame_ids = np.arange(frames)[:, None]
+    cam_obj.rotation_mode = "QUATERNION"
+    cam_obj.location = locations[0]
+    cam_obj.rotation_quaternion = quaternions[0]
+    butil.set_keyframes(cam_obj, "location", np.hstack([frame_ids, locations]))
+    butil.set_keyframes(cam_obj, "rotation_quaternion", np.hstack([frame_ids, quaternions]))
+    if world_mapping_node:
+        rotation = world_mapping_node.inputs["Rotation"]
+        rotation.default_value[2] = angles[0]
+        butil.set_keyframes(
+            world_mapping_node.id_data,
+            rotation.path_from_id("default_value"),
+            np.hstack([frame_ids, angles[:, None]]),
+            index=2,
+        )
 
 
-def setup_depth_and_normal_layers(result_dir: str):
+def setup_depth_and_normal_layers(result_dir: str, depth_format: str = "EXR32"):
     bpy.context.scene.render.use_compositing = True
     bpy.context.scene.use_nodes = True
     tree = bpy.context.scene.node_tree
@@ -69,35 +120,100 @@ def setup_depth_and_normal_layers(result_dir: str):
         render_layer_node.outputs["Normal"], normal_output_node.inputs["Image"]
     )
 
-    depth_output_node = tree.nodes.new("CompositorNodeOutputFile")
-    depth_output_node.base_path = os.path.join(result_dir, "depth")
-    depth_output_node.format.file_format = "PNG"  #'OPEN_EXR'
-    depth_output_node.format.color_depth = "32"
-    depth_output_node.format.color_mode = "BW"
-    tree.links.new(
-        render_layer_node.outputs["Depth"], depth_output_node.inputs["Image"]
+    return butil.add_depth_output(
+        tree, render_layer_node, os.path.join(result_dir, "depth"), depth_format
     )
 
 
 def rename_node_output_files(save_dir: str, idx: int):
-    os.rename(
-        os.path.join(save_dir, "normal", "Image0001.exr"),
-        os.path.join(save_dir, "normal", f"{str(idx)}.exr"),
-    )
-    os.rename(
-        os.path.join(save_dir, "depth", "Image0001.exr"),
-        os.path.join(save_dir, "depth", f"{str(idx)}.exr"),
-    )
+    # the file output nodes name their files Image<frame>.<ext>, the extension depends on the
+    # format, the NPY depth writer <frame>.npy, all of them become <idx>.<ext>
+    frame = bpy.context.scene.frame_current
+    prefixes = (f"Image{frame:04d}.", f"{frame:04d}.")
+    for sub_dir in ["normal", "depth"]:
+        for file in os.listdir(os.path.join(save_dir, sub_dir)):
+            if file.startswith(prefixes):
+                os.rename(
+                    os.path.join(save_dir, sub_dir, file),
+                    os.path.join(save_dir, sub_dir, str(idx) + os.path.splitext(file)[1]),
+                )
+
+
+
+def render_frames(config: Dict) -> None:
+    scene = bpy.context.scene
+    if config["video"] and config.get("stream_video"):
+        # frames go straight from the render into the encoder, no PNG sequence in between
+        video_file = scene.render.frame_path(frame=scene.frame_start)
+        butil.render_frames_to_video(
+            video_file,
+            fps=scene.render.fps,
+            keep_frames_dir=os.path.dirname(video_file) if config.get("keep_frames") else None,
+        )
+    else:
+        bpy.ops.render.render(animation=True)
 
 
+def render_animation(config: Dict) -> None:
+    """
+    Render the scene frame range. With config["cache_dir"] set, frames whose inputs
+    (model/plane/hdr content, config, blender and renderer version) were rendered
+    before are copied from the cache and only the remaining frames are rendered.
+    The cache holds the beauty frames only, jobs writing aovs always render.
+    """
+    if not config.get("cache_dir") or config.get("aovs"):
+        render_frames(config)
+        return
 
-def render_showreel(config: Dict, save_dir: str) -> None:
-    bpy.ops.object.select_all(action="SELECT")
-    bpy.ops.object.delete(use_global=False)
+    scene = bpy.context.scene
+    cache = cutil.RenderCache(config["cache_dir"], config.get("render_cache_max_bytes", 20 << 30))
+    job_key = cutil.render_cache_key(config, bpy.app.version_string, RENDERER_VERSION)
+    frame_start, frame_end = scene.frame_start, scene.frame_end
+
+    if config["video"]:
+        # a video can only be cached as a whole
+        key = cache.frame_key(job_key, f"{frame_start}-{frame_end}")
+        video_file = scene.render.frame_path(frame=frame_start)
+        if not cache.get(key, video_file):
+            render_frames(config)
+            cache.put(key, video_file)
+        return
+
+    missing = []
+    for frame in range(frame_start, frame_end + 1):
+        if not cache.get(cache.frame_key(job_key, frame), scene.render.frame_path(frame=frame)):
+            missing.append(frame)
+    print(f"render cache: {frame_end - frame_start + 1 - len(missing)} frames cached, {len(missing)} to render")
+
+    for start, end in rjobs.contiguous_ranges(missing):
+        for frame in range(start, end + 1):
+            # may be a hard link into the cache, never let blender overwrite it in place
+            if os.path.exists(scene.render.frame_path(frame=frame)):
+                os.remove(scene.render.frame_path(frame=frame))
+        scene.frame_start = start
+        scene.frame_end = end
+        bpy.ops.render.render(animation=True)
+        for frame in range(start, end + 1):
+            cache.put(cache.frame_key(job_key, frame), scene.render.frame_path(frame=frame))
+    scene.frame_start = frame_start
+    scene.frame_end = frame_end
+
+
+def setup_shared_scene(config: Dict) -> Dict:
+    """
+    Set up everything that does not depend on the model: plane, camera, lights and world.
+    """
+    butil.reset_scene()
 
     bpy.context.scene.render.film_transparent = True
     bpy.context.scene.render.image_settings.color_mode = "RGBA"
 
+    butil.hdr_pool.max_bytes = config.get("hdr_pool_max_bytes", butil.hdr_pool.max_bytes)
+    if config.get("import_cache_dir"):
+        butil.enable_import_cache(
+            config["import_cache_dir"], config.get("import_cache_max_bytes", 20 << 30)
+        )
+
     plane_obj = butil.load_object(config["plane_file"])
     if config["set_plane_material"]:
         plane_obj.active_material.use_nodes = True
@@ -110,20 +226,11 @@ def render_showreel(config: Dict, save_dir: str) -> None:
         tree.links.new(glossy_node.outputs[0], output_node.inputs[0])
         output_node.is_active_output = True
 
-    model_obj = butil.load_object(config["model_file"])
-    normalize_object(model_obj)
-
-    plane_obj.location += model_obj.location
-
     cam_obj = butil.add_camera()
     cam_obj.data.lens_unit = "FOV"
     cam_obj.data.angle = np.radians(15)
 
-    radius = config["radius"]
-    angle = config["angle"] / 180 * np.pi
-    camera_center = Vector([radius * np.cos(angle), 0, radius * np.sin(angle)])
-    cam_obj.matrix_world = butil.get_lookat_transfrom(camera_center, Vector([0, 0, 0]))
-
+    lights = []
     if config["bg_lighting"]:
         butil.set_world_background_hdr(img_path=config["bg_file"], strength=1.0)
     else:
@@ -135,33 +242,111 @@ def render_showreel(config: Dict, save_dir: str) -> None:
         light_obj2.matrix_world = butil.get_lookat_transfrom(
             light_obj2.location, Vector([0, 0, 0])
         )
+        lights = [light_obj1, light_obj2]
 
+    return {
+        "plane": plane_obj,
+        "plane_location": plane_obj.location.copy(),
+        "camera": cam_obj,
+        # the calibration turntable changes the lens and pixel aspect, restored per job
+        "camera_state": butil.save_camera_state(cam_obj),
+        # the camera turntable parents the lights, keep their world pose to restore it per job
+        "lights": [(obj, obj.matrix_world.copy()) for obj in lights],
+    }
 
-    # # if successfully setup, the ouput will be RGBA png, where R is metallic G is roughness
-    # if butil.setup_metallic_roughness_rendering(model_obj):
-    #     metallic_roughness_dir = os.path.join(save_dir, "metallic_roughness")
-    #     os.makedirs(metallic_roughness_dir, exist_ok=True)
 
-    # else:
-    #     print("failed to setup metallic roughness rendering")
+def render_model(config: Dict, save_dir: str, shared: Dict) -> bpy.types.Object:
+    plane_obj = shared["plane"]
+    cam_obj = shared["camera"]
 
+    model_obj = butil.load_object(config["model_file"])
+    with putil.span("normalize_object"):
+        normalization = normalize_object(model_obj, config.get("bbox_mode", "exact"))
 
+    plane_obj.location = shared["plane_location"] + model_obj.location
+
+    for light_obj, matrix in shared["lights"]:
+        light_obj.parent = None
+        light_obj.matrix_world = matrix
+
+    radius = config["radius"]
+    angle = config["angle"] / 180 * np.pi
+    camera_center = Vector([radius * np.cos(angle), 0, radius * np.sin(angle)])
+    butil.restore_camera_state(cam_obj, shared["camera_state"])
+    cam_obj.rotation_mode = "XYZ"
+    cam_obj.matrix_world = butil.get_lookat_transfrom(camera_center, Vector([0, 0, 0]))
+
+    # one switcher per model, its node lookups are reused and restore() undoes the switch
+    switcher = butil.MaterialPassSwitcher(model_obj)
+    # the pass outputs of a previous job in the batch would write into its directory
+    butil.remove_pass_outputs()
+    if config.get("aovs"):
+        # all channels are written from the single beauty render
+        butil.setup_material_aovs(model_obj)
+        butil.setup_pass_outputs(
+            save_dir,
+            config["aovs"],
+            multilayer=config.get("multilayer_exr", False),
+            depth_format=config.get("depth_format", "EXR32"),
+        )
     # if successfully setup, the ouput will be RGBA png, where RGB is based color (albedo)
-    if butil.setup_base_color_rendering(model_obj):
+    elif butil.setup_base_color_rendering(model_obj, switcher):
         albedo_dir = os.path.join(save_dir, "albedo")
         os.makedirs(albedo_dir, exist_ok=True)
     else:
         print("failed to setup albedo rendering")
 
-
-
-
-    rotate_object_and_set_keyframes(model_obj, config["frames"])
+    world_mapping_node = None
+    if config["bg_lighting"]:
+        # jobs may vary bg_file, the world nodes are reused and decoded images pooled
+        world_mapping_node = butil.set_world_background_hdr(img_path=config["bg_file"])
+
+    image_size = (config["resolution"], config["resolution"])
+    with putil.span("keyframes"):
+        if config.get("turntable", "object") == "camera":
+            orbit_camera_and_set_keyframes(
+                cam_obj,
+                model_obj.location,
+                config["frames"],
+                lights=[obj for obj, _ in shared["lights"]]
+                if config.get("lights_follow_camera", True)
+                else None,
+                world_mapping_node=world_mapping_node,
+            )
+            bpy.context.scene.render.use_persistent_data = True
+        elif config.get("turntable") == "calibration":
+            # a captured sequence: per-frame K and opencv world to camera matrices, the
+            # images are rendered at the captured size, K is in its pixels
+            calibration = np.load(config["camera_file"])
+            if "image_size" in calibration:
+                image_size = tuple(int(x) for x in calibration["image_size"])
+            butil.set_camera_sequence_from_calibration(
+                calibration["K"],
+                calibration["extrinsics"],
+                image_size[0],
+                image_size[1],
+                convention=str(calibration.get("convention", "opencv_w2c")),
+            )
+            bpy.context.scene.render.use_persistent_data = True
+        else:
+            rotate_object_and_set_keyframes(model_obj, config["frames"])
+    scene = bpy.context.scene
+    keyed_frames = np.arange(scene.frame_start, scene.frame_end + 1)
+    # render a sub range of the turntable only, used to shard it across workers
+    if "frame_start" in config:
+        bpy.context.scene.frame_start = config["frame_start"]
+    if "frame_end" in config:
+        bpy.context.scene.frame_end = config["frame_end"]
 
     bpy.context.scene.render.engine = "CYCLES"
     bpy.context.scene.cycles.samples = config["samples"]
-    bpy.context.scene.render.resolution_x = config["resolution"]
-    bpy.context.scene.render.resolution_y = config["resolution"]
+    bpy.context.scene.render.resolution_x = image_size[0]
+    bpy.context.scene.render.resolution_y = image_size[1]
+
+    # cameras of the whole turntable, every chunk of a sharded job writes the same file
+    butil.save_transforms(
+        os.path.join(save_dir, "transforms.npz"), cam_obj, keyed_frames, model_obj, normalization
+    )
 
     if not save_dir.endswith("/"):
         save_dir += "/"
@@ -175,15 +360,126 @@ def render_showreel(config: Dict, save_dir: str) -> None:
         bpy.context.scene.render.image_settings.file_format = "PNG"
         bpy.context.scene.render.filepath = save_dir
 
-    bpy.ops.render.render(animation=True)
-
+    try:
+        with putil.span("render", frames=scene.frame_end - scene.frame_start + 1):
+            render_animation(config)
+    finally:
+        switcher.restore()
+        # the NPY depth writer of this job must not fire for the next one
+        butil.DepthNpyWriter.unregister_all()
+    return model_obj
+
+
+def start_profiling(config: Dict, save_dir: str) -> None:
+    # per-frame and per-step timings of the job, see utils/profile_util.py
+    if config.get("profile"):
+        putil.start_profiling(
+            os.path.join(save_dir, "profile.jsonl"), job=config.get("name"), modules=[butil]
+        )
 
 
+def stop_profiling(config: Dict, save_dir: str) -> None:
+    if config.get("profile"):
+        putil.stop_profiling(os.path.join(save_dir, "profile.trace.json"))
 
 
+def render_showreel(config: Dict, save_dir: str) -> None:
+    start_profiling(config, save_dir)
+    try:
+        shared = setup_shared_scene(config)
+        render_model(config, save_dir, shared)
+    finally:
+        stop_profiling(config, save_dir)
+
+
+def render_showreel_batch(config: Dict, jobs: List[Dict], save_dir: str) -> None:
+    """
+    Render many models in one Blender process. The plane, camera, lights and world
+    are set up once, only the model datablocks are swapped between jobs.
+    Keys of a job override the base config, e.g. {"model_file": ..., "frames": 48}.
+    """
+    pending = []
+    for k, job in enumerate(jobs):
+        if rjobs.is_job_done(rjobs.job_dir(job, save_dir)):
+            print(f"[{k + 1}/{len(jobs)}] already done: {rjobs.job_dir(job, save_dir)}")
+        else:
+            pending.append((k, job))
+
+    # remote (manifold://) inputs of the next jobs download while the current one renders
+    # pinned in the download cache until their last job finished, prefetches never evict them
+    fetch = functools.partial(
+        mfd.download_if_on_manifold,
+        tmp_dir=config.get("download_dir", "downloads"),
+        max_bytes=config.get("download_max_bytes", 20 << 30),
+        pin=True,
+    )
+    release = functools.partial(
+        mfd.release_if_on_manifold, tmp_dir=config.get("download_dir", "downloads")
+    )
+    prefetcher = rjobs.AssetPrefetcher(
+        [{**config, **job} for _, job in pending],
+        fetch,
+        config.get("prefetch_jobs", 2),
+        release=release,
+    )
+    failed = []
+    with prefetcher:
+        # the base config's model_file is a default, never a job, the shared scene needs
+        # only the plane and the world
+        shared = setup_shared_scene(prefetcher.resolve(config, SHARED_ASSET_KEYS))
+        for idx, (k, job) in enumerate(pending):
+            job_config = {**config, **job}
+            job_dir = rjobs.job_dir(job, save_dir)
+            print(f"[{k + 1}/{len(jobs)}] rendering {job_config['model_file']} to {job_dir}")
+            prefetcher.prefetch(idx)
+
+            snapshot = butil.snapshot_datablocks()
+            start_profiling(job_config, job_dir)
+            try:
+                render_model(prefetcher.resolve(job_config), job_dir, shared)
+                rjobs.mark_job_done(job_dir, {"model_file": job_config["model_file"]})
+            except Exception as e:
+                print(f"failed to render {job_config['model_file']}: {e}")
+                failed.append(job["name"])
+            finally:
+                stop_profiling(job_config, job_dir)
+                butil.remove_datablocks_since(snapshot)
+                # whatever the job left unreferenced in the shared scene, keeps the worker flat
+                butil.purge_orphans()
+                prefetcher.finish(idx)
+
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(jobs)} jobs failed: {failed}")
+
+
+def parse_args():
+    # blender passes the script arguments after "--"
+    argv = sys.argv[sys.argv.index("--") + 1 :] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(
+        description="showreel rendering",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=None,
+        help="json file overriding the default config",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="json/jsonl list of model files (or job dicts) to render in one process",
+    )
+    parser.add_argument(
+        "--save_dir",
+        type=str,
+        default="temp",
+        help="output folder, one sub folder per job in manifest mode",
+    )
+    return parser.parse_args(argv)
 
 
-save_dir = "temp"
 config = {}
 config["plane_file"] = "data/glbs/plane_round.glb"
 config["set_plane_material"] = True
@@ -195,8 +491,33 @@ config["radius"] = 5
 config["angle"] = 5
 config["resolution"] = 1024
 config["video"] = False 
+config["stream_video"] = False  # encode while rendering, needs video
 config["samples"] = 64
 config["frames"] = 1
 config["bg_lighting"] = False
-
-render_showreel(config=config, save_dir=save_dir)
\ No newline at end of file
+config["turntable"] = "object"  # "camera" orbits the camera around the static model instead
+# with turntable "calibration": npz with "K" (N, 3, 3) and "extrinsics" (N, 4, 4) opencv w2c,
+# optionally "image_size" (width, height) of the captured images, else resolution x resolution
+config["camera_file"] = None
+config["profile"] = False  # write profile.jsonl and profile.trace.json next to the renders
+# e.g. ["albedo", "metallic_roughness", "depth", "normal"], written next to the beauty render
+config["aovs"] = None
+# "exact" normalizes with the evaluated vertices, "fast" with the bound_box corners
+config["bbox_mode"] = "exact"
+# batch mode: manifold:// inputs are cached in download_dir, the next prefetch_jobs are
+# downloaded while the current job renders
+config["download_dir"] = "downloads"
+config["prefetch_jobs"] = 2
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.config:
+        with open(args.config) as f:
+            config.update(json.load(f))
+
+    if args.manifest:
+        render_showreel_batch(
+            config=config, jobs=rjobs.load_manifest(args.manifest), save_dir=args.save_dir
+        )
+    else:
+        render_showreel(config=config, save_dir=args.save_dir)
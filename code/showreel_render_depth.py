@@ -19,17 +19,9 @@ import utils.blender_util as butil
 # import utils.manifold_util as mfd
 
 
-def normalize_object(obj: bpy.types.Object):
-    bbox_min = None
-    bbox_max = None
-    for v in obj.bound_box:
-        v = obj.matrix_world @ Vector(v)
-        bbox_max = np.maximum(bbox_max, v) if bbox_max is not None else v
-        bbox_min = np.minimum(bbox_min, v) if bbox_min is not None else v
-    scale = 1 / max(bbox_max - bbox_min)
-    offset = -(bbox_min + bbox_max) / 2
-    T = Matrix.Diagonal([scale, scale, scale, 1.0]) @ Matrix.Translation(offset)
-    obj.matrix_world = T @ obj.matrix_world
+def normalize_object(obj: bpy.types.Object, mode: str = "exact") -> np.ndarray:
+    # fit the model (and its children) into the unit cube, returns the applied transform
+    return butil.normalize_objects([obj], mode)
 
 
 def rotate_object_and_set_keyframes(obj, frames=360):
@@ -38,16 +30,15 @@ def rotate_object_and_set_keyframes(obj, frames=360):
     bpy.context.scene.frame_start = 0
     bpy.context.scene.frame_end = frames - 1
 
-    # Rotate and set keyframe for each frame
-    for frame in range(frames):
-        angle = (frame - 1) * (np.pi * 2 / frames)
-        obj.rotation_mode = "XYZ"
-        obj.rotation_euler[2] = angle  # Rotate around Z-axis
-        obj.keyframe_insert(data_path="rotation_euler", frame=frame)
+    # Rotate around Z-axis, one keyframe per frame
+    frame_ids = np.arange(frames)
+    angles = (frame_ids - 1) * (np.pi * 2 / frames)
+    obj.rotation_mode = "XYZ"
+    butil.set_keyframes(obj, "rotation_euler", np.stack([frame_ids, angles], axis=1), index=2)
 
 
 
-def setup_depth_and_normal_layers(result_dir: str):
+def setup_depth_and_normal_layers(result_dir: str, depth_format: str = "EXR32"):
     bpy.context.scene.render.use_compositing = True
     bpy.context.scene.use_nodes = True
     tree = bpy.context.scene.node_tree
@@ -69,21 +60,10 @@ def setup_depth_and_normal_layers(result_dir: str):
         render_layer_node.outputs["Normal"], normal_output_node.inputs["Image"]
     )
 
-    # depth_output_node = tree.nodes.new("CompositorNodeOutputFile")
-    # depth_output_node.base_path = os.path.join(result_dir, "depth")
-    # depth_output_node.format.file_format = "PNG"  #'OPEN_EXR'
-    # depth_output_node.format.color_depth = "16"
-    # depth_output_node.format.color_mode = "BW"
-    # depth_normalize_node = tree.nodes.new("CompositorNodeNormalize")
-    # # tree.links.new(
-    # #     render_layer_node.outputs["Depth"], depth_normalize_node.inputs[0]
-    # # )
-    # # tree.links.new(
-    # #     depth_normalize_node.outputs[0], depth_output_node.inputs["Image"]
-    # # )
-    # tree.links.new(
-    #     render_layer_node.outputs["Depth"], depth_output_node.inputs["Image"]
-    # )
+    # metric depth, a PNG would clip it, see butil.DEPTH_FORMATS
+    return butil.add_depth_output(
+        tree, render_layer_node, os.path.join(result_dir, "depth"), depth_format
+    )
 
 
 
@@ -109,8 +89,7 @@ def setup_depth_and_normal_layers(result_dir: str):
 
 
 def render_showreel(config: Dict, save_dir: str) -> None:
-    bpy.ops.object.select_all(action="SELECT")
-    bpy.ops.object.delete(use_global=False)
+    butil.reset_scene()
 
     bpy.context.scene.render.film_transparent = True
     bpy.context.scene.render.image_settings.color_mode = "RGBA"
@@ -129,9 +108,12 @@ def render_showreel(config: Dict, save_dir: str) -> None:
 
 
 
-    model_obj = butil.load_object(config["model_file"])
-    normalize_object(model_obj)
+    # the model is shaded with a plain diffuse material, its own materials are never needed
+    model_obj = butil.load_object_geometry(config["model_file"])
+    normalization = normalize_object(model_obj)
     if True:
+        if not model_obj.active_material:
+            model_obj.data.materials.append(bpy.data.materials.new("Diffuse"))
         model_obj.active_material.use_nodes = True
         tree = model_obj.active_material.node_tree
         output_node = tree.nodes.new(type="ShaderNodeOutputMaterial")
@@ -164,7 +146,7 @@ def render_showreel(config: Dict, save_dir: str) -> None:
             light_obj2.location, Vector([0, 0, 0])
         )
 
-    setup_depth_and_normal_layers(save_dir)
+    depth_output = setup_depth_and_normal_layers(save_dir, config["depth_format"])
 
 
 
@@ -174,6 +156,12 @@ def render_showreel(config: Dict, save_dir: str) -> None:
     bpy.context.scene.cycles.samples = config["samples"]
     bpy.context.scene.render.resolution_x = config["resolution"]
     bpy.context.scene.render.resolution_y = config["resolution"]
+    butil.save_transforms(
+        os.path.join(save_dir, "transforms.npz"),
+        cam_obj,
+        model_obj=model_obj,
+        normalization=normalization,
+    )
 
     if not save_dir.endswith("/"):
         save_dir += "/"
@@ -187,7 +175,11 @@ def render_showreel(config: Dict, save_dir: str) -> None:
         bpy.context.scene.render.image_settings.file_format = "PNG"
         bpy.context.scene.render.filepath = save_dir
 
-    bpy.ops.render.render(animation=True)
+    try:
+        bpy.ops.render.render(animation=True)
+    finally:
+        if isinstance(depth_output, butil.DepthNpyWriter):
+            depth_output.unregister()
 
 
 
@@ -213,5 +205,6 @@ config["video"] = False
 config["samples"] = 64
 config["frames"] = 24*8
 config["bg_lighting"] = False
+config["depth_format"] = "EXR32"  # "EXR16", "EXR32" or "NPY"
 
 render_showreel(config=config, save_dir=save_dir)
\ No newline at end of file
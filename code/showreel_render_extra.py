@@ -19,21 +19,13 @@ import utils.blender_util as butil
 # import utils.manifold_util as mfd
 
 
-def normalize_object(obj: bpy.types.Object):
-    bbox_min = None
-    bbox_max = None
-    for v in obj.bound_box:
-        v = obj.matrix_world @ Vector(v)
-        bbox_max = np.maximum(bbox_max, v) if bbox_max is not None else v
-        bbox_min = np.minimum(bbox_min, v) if bbox_min is not None else v
-    scale = 1 / max(bbox_max - bbox_min)
-    offset = -(bbox_min + bbox_max) / 2
-    T = Matrix.Diagonal([scale, scale, scale, 1.0]) @ Matrix.Translation(offset)
-    obj.matrix_world = T @ obj.matrix_world
+def normalize_object(obj: bpy.types.Object, mode: str = "exact") -> np.ndarray:
+    # fit the model (and its children) into the unit cube, returns the applied transform
+    return butil.normalize_objects([obj], mode)
 
 
 
-def setup_depth_and_normal_layers(result_dir: str):
+def setup_depth_and_normal_layers(result_dir: str, depth_format: str = "EXR32"):
     bpy.context.scene.render.use_compositing = True
     bpy.context.scene.use_nodes = True
     tree = bpy.context.scene.node_tree
@@ -55,31 +47,28 @@ def setup_depth_and_normal_layers(result_dir: str):
         render_layer_node.outputs["Normal"], normal_output_node.inputs["Image"]
     )
 
-    depth_output_node = tree.nodes.new("CompositorNodeOutputFile")
-    depth_output_node.base_path = os.path.join(result_dir, "depth")
-    depth_output_node.format.file_format = "PNG"  #'OPEN_EXR'
-    depth_output_node.format.color_depth = "32"
-    depth_output_node.format.color_mode = "BW"
-    tree.links.new(
-        render_layer_node.outputs["Depth"], depth_output_node.inputs["Image"]
+    return butil.add_depth_output(
+        tree, render_layer_node, os.path.join(result_dir, "depth"), depth_format
     )
 
 
 def rename_node_output_files(save_dir: str, idx: int):
-    os.rename(
-        os.path.join(save_dir, "normal", "Image0001.exr"),
-        os.path.join(save_dir, "normal", f"{str(idx)}.exr"),
-    )
-    os.rename(
-        os.path.join(save_dir, "depth", "Image0001.exr"),
-        os.path.join(save_dir, "depth", f"{str(idx)}.exr"),
-    )
+    # the file output nodes name their files Image<frame>.<ext>, the extension depends on the
+    # format, the NPY depth writer <frame>.npy, all of them become <idx>.<ext>
+    frame = bpy.context.scene.frame_current
+    prefixes = (f"Image{frame:04d}.", f"{frame:04d}.")
+    for sub_dir in ["normal", "depth"]:
+        for file in os.listdir(os.path.join(save_dir, sub_dir)):
+            if file.startswith(prefixes):
+                os.rename(
+                    os.path.join(save_dir, sub_dir, file),
+                    os.path.join(save_dir, sub_dir, str(idx) + os.path.splitext(file)[1]),
+                )
 
 
 
 def render_showreel(config: Dict, save_dir: str) -> None:
-    bpy.ops.object.select_all(action="SELECT")
-    bpy.ops.object.delete(use_global=False)
+    butil.reset_scene()
 
     bpy.context.scene.render.film_transparent = True
     bpy.context.scene.render.image_settings.color_mode = "RGBA"
@@ -96,8 +85,9 @@ def render_showreel(config: Dict, save_dir: str) -> None:
         tree.links.new(glossy_node.outputs[0], output_node.inputs[0])
         output_node.is_active_output = True
 
-    model_obj = butil.load_object(config["model_file"])
-    normalize_object(model_obj)
+    # only depth and normal are rendered, materials and textures are never needed
+    model_obj = butil.load_object_geometry(config["model_file"])
+    normalization = normalize_object(model_obj)
 
     plane_obj.location += model_obj.location
 
@@ -111,17 +101,26 @@ def render_showreel(config: Dict, save_dir: str) -> None:
     cam_obj.matrix_world = butil.get_lookat_transfrom(camera_center, Vector([0, 0, 0]))
 
 
-    setup_depth_and_normal_layers(save_dir)
+    depth_output = setup_depth_and_normal_layers(save_dir, config["depth_format"])
 
     obj = model_obj
     frames = config["frames"]
-    for frame in range(frames):
-        angle = (frame - 1) * (np.pi * 2 / frames)
-        obj.rotation_mode = "XYZ"
-        obj.rotation_euler[2] = angle  # Rotate around Z-axis
-        obj.keyframe_insert(data_path="rotation_euler", frame=frame)
-
-        rename_node_output_files(save_dir, frame)
+    frame_ids = np.arange(frames)
+    angles = (frame_ids - 1) * (np.pi * 2 / frames)
+    obj.rotation_mode = "XYZ"
+    butil.set_keyframes(obj, "rotation_euler", np.stack([frame_ids, angles], axis=1), index=2)
+    butil.save_transforms(
+        os.path.join(save_dir, "transforms.npz"), cam_obj, frame_ids, model_obj, normalization
+    )
+    try:
+        for frame in range(frames):
+            # the file output nodes write on render, nothing to rename otherwise
+            bpy.context.scene.frame_set(frame)
+            bpy.ops.render.render()
+            rename_node_output_files(save_dir, frame)
+    finally:
+        if isinstance(depth_output, butil.DepthNpyWriter):
+            depth_output.unregister()
 
 
 
@@ -160,5 +159,6 @@ config["video"] = False
 config["samples"] = 64
 config["frames"] = 1
 config["bg_lighting"] = False
+config["depth_format"] = "EXR32"  # "EXR16", "EXR32" or "NPY"
 
 render_showreel(config=config, save_dir=save_dir)
\ No newline at end of file
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the scripts import the helpers as utils.*, run from the code folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
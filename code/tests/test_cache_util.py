@@ -0,0 +1,115 @@
+import os
+
+from utils import cache_util as cutil
+
+
+def make_fetch(sizes, calls):
+    # fetch(source, dest_file) writing sizes[source] bytes, records every call
+    def fetch(source, dest_file):
+        calls.append(source)
+        with open(dest_file, "wb") as f:
+            f.write(b"x" * sizes[source])
+
+    return fetch
+
+
+def test_blob_cache_hit_and_miss(tmp_path):
+    calls = []
+    cache = cutil.BlobCache(str(tmp_path / "cache"))
+    fetch = make_fetch({"remote/a.glb": 10}, calls)
+
+    path = cache.get("remote/a.glb", fetch)
+    assert path.endswith(".glb") and os.path.getsize(path) == 10
+    assert cache.get("remote/a.glb", fetch) == path
+    assert calls == ["remote/a.glb"]
+    assert cache.total_bytes() == 10
+
+    # a blob removed behind the index is fetched again
+    os.remove(path)
+    assert cache.get("remote/a.glb", fetch) == path
+    assert calls == ["remote/a.glb", "remote/a.glb"]
+
+
+def test_blob_cache_failed_fetch_is_no_hit(tmp_path):
+    cache = cutil.BlobCache(str(tmp_path / "cache"))
+
+    def fetch(source, dest_file):
+        with open(dest_file, "wb") as f:
+            f.write(b"partial")
+        raise OSError("connection reset")
+
+    try:
+        cache.get("remote/a.glb", fetch)
+        assert False, "expected the fetch error"
+    except OSError:
+        pass
+    assert cache.total_bytes() == 0
+    assert not os.path.exists(cache.path("remote/a.glb"))
+
+
+def test_blob_cache_evicts_least_recently_used(tmp_path):
+    calls = []
+    sources = [f"remote/{k}.bin" for k in range(5)]
+    cache = cutil.BlobCache(str(tmp_path / "cache"), max_bytes=2500)
+    fetch = make_fetch({source: 1000 for source in sources}, calls)
+
+    paths = [cache.get(source, fetch) for source in sources]
+    assert cache.total_bytes() <= 2500
+    assert [os.path.exists(path) for path in paths] == [False, False, False, True, True]
+
+    # a hit counts as use: 3 survives the next eviction, 4 does not
+    cache.get(sources[3], fetch)
+    cache.get(sources[0], fetch)
+    assert [os.path.exists(path) for path in paths] == [True, False, False, True, False]
+
+
+def test_blob_cache_keeps_pinned_blobs(tmp_path):
+    calls = []
+    sources = [f"remote/{k}.bin" for k in range(5)]
+    cache = cutil.BlobCache(str(tmp_path / "cache"), max_bytes=2500)
+    fetch = make_fetch({source: 1000 for source in sources}, calls)
+
+    paths = [cache.get(source, fetch, pin=True) for source in sources]
+    assert all(os.path.exists(path) for path in paths)
+    assert cache.total_bytes() == 5000
+
+    # the pins of another cache instance (another process) count as well
+    other = cutil.BlobCache(str(tmp_path / "cache"), max_bytes=2500)
+    other.evict()
+    assert all(os.path.exists(path) for path in paths)
+
+    for source in sources:
+        cache.release(source)
+    cache.evict()
+    assert cache.total_bytes() <= 2500
+    assert len(calls) == 5
+
+
+def test_blob_cache_pins_nest(tmp_path):
+    cache = cutil.BlobCache(str(tmp_path / "cache"), max_bytes=0)
+    fetch = make_fetch({"remote/a.bin": 10}, [])
+
+    path = cache.get("remote/a.bin", fetch, pin=True)
+    cache.pin("remote/a.bin")
+    cache.release("remote/a.bin")
+    cache.evict()
+    assert os.path.exists(path)
+    cache.release("remote/a.bin")
+    cache.evict()
+    assert not os.path.exists(path)
+
+
+def test_render_cache_evicts_least_recently_used(tmp_path):
+    cache = cutil.RenderCache(str(tmp_path / "cache"), max_bytes=2500)
+    keys = [cache.frame_key("job", frame) for frame in range(3)]
+    src = str(tmp_path / "frame.png")
+    with open(src, "wb") as f:
+        f.write(b"x" * 1000)
+    for k, key in enumerate(keys[:2]):
+        cache.put(key, src)
+        os.utime(cache.path(key, ".png"), (k, k))
+
+    # a hit counts as use: 0 survives the next put, 1 does not
+    assert cache.get(keys[0], str(tmp_path / "out" / "0.png"))
+    cache.put(keys[2], src)
+    assert [os.path.exists(cache.path(key, ".png")) for key in keys] == [True, False, True]
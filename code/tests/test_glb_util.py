@@ -0,0 +1,73 @@
+import json
+import struct
+
+import numpy as np
+import pytest
+
+from utils import glb_util
+
+
+def write_glb(path, gltf, bin_data=b""):
+    json_data = json.dumps(gltf).encode()
+    json_data += b" " * (-len(json_data) % 4)
+    bin_data += b"\0" * (-len(bin_data) % 4)
+    chunks = struct.pack("<II", len(json_data), glb_util.CHUNK_JSON) + json_data
+    if bin_data:
+        chunks += struct.pack("<II", len(bin_data), glb_util.CHUNK_BIN) + bin_data
+    with open(path, "wb") as f:
+        f.write(struct.pack("<III", glb_util.GLB_MAGIC, 2, 12 + len(chunks)) + chunks)
+
+
+def triangle_gltf(**primitive):
+    # one triangle, positions in bufferView 0, no indices
+    return {
+        "asset": {"version": "2.0"},
+        "scenes": [{"nodes": [0]}],
+        "nodes": [{"mesh": 0}],
+        "meshes": [{"primitives": [{"attributes": {"POSITION": 0}, **primitive}]}],
+        "accessors": [{"bufferView": 0, "componentType": 5126, "count": 3, "type": "VEC3"}],
+        "bufferViews": [{"buffer": 0, "byteLength": 36}],
+        "buffers": [{"byteLength": 36}],
+    }
+
+
+def test_load_glb_geometry_triangle(tmp_path):
+    positions = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], dtype=np.float32)
+    write_glb(tmp_path / "a.glb", triangle_gltf(), positions.tobytes())
+
+    verts, tris = glb_util.load_glb_geometry(str(tmp_path / "a.glb"))
+    # +Y up to +Z up
+    np.testing.assert_allclose(verts, [[0, 0, 0], [1, 0, 0], [0, 0, 1]], atol=1e-7)
+    np.testing.assert_array_equal(tris, [[0, 1, 2]])
+
+
+def test_unsupported_inputs_raise_unsupported_glb_error(tmp_path):
+    positions = np.zeros((3, 3), dtype=np.float32).tobytes()
+    draco = triangle_gltf(extensions={"KHR_draco_mesh_compression": {}})
+    write_glb(tmp_path / "draco.glb", draco, positions)
+    external = triangle_gltf()
+    external["bufferViews"][0]["buffer"] = 1
+    write_glb(tmp_path / "external.glb", external, positions)
+    (tmp_path / "model.obj").write_text("v 0 0 0\n")
+
+    for name in ["draco.glb", "external.glb", "model.obj"]:
+        with pytest.raises(glb_util.UnsupportedGlbError):
+            glb_util.load_glb_geometry(str(tmp_path / name))
+
+
+def test_normalized_signed_accessor_is_clamped():
+    gltf = {
+        "accessors": [
+            {
+                "bufferView": 0,
+                "componentType": 5120,
+                "count": 3,
+                "type": "SCALAR",
+                "normalized": True,
+            }
+        ],
+        "bufferViews": [{"buffer": 0, "byteLength": 3}],
+    }
+    bin_chunk = np.array([-128, -127, 127], dtype=np.int8).view(np.uint8)
+    array = glb_util.get_accessor_array(gltf, bin_chunk, 0)
+    np.testing.assert_allclose(array.ravel(), [-1, -1, 1])
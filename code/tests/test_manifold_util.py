@@ -0,0 +1,182 @@
+import functools
+import os
+
+from utils import manifold_util as mfd
+from utils import render_jobs as rjobs
+
+
+def make_remote(tmp_path, names, size=1000):
+    # a LocalDirBackend with manifold://bucket/<name> files of size bytes
+    backend = mfd.LocalDirBackend(str(tmp_path / "remote"))
+    os.makedirs(backend.local_path("manifold://bucket"))
+    for name in names:
+        with open(backend.local_path(f"manifold://bucket/{name}"), "wb") as f:
+            f.write(name.encode() * (size // len(name)))
+    return backend, [f"manifold://bucket/{name}" for name in names]
+
+
+def test_fetch_many_keeps_every_download(tmp_path):
+    backend, paths = make_remote(tmp_path, [f"{k}.glb" for k in range(5)])
+    tmp_dir = str(tmp_path / "cache")
+
+    local_paths = mfd.fetch_many(paths, tmp_dir, max_bytes=2500, backend=backend)
+    assert all(os.path.exists(local_paths[path]) for path in paths)
+
+    mfd.release_many(paths, tmp_dir)
+    mfd.get_blob_cache(tmp_dir).evict()
+    assert mfd.get_blob_cache(tmp_dir).total_bytes() <= 2500
+
+
+def test_asset_prefetcher_releases_finished_jobs(tmp_path):
+    backend, paths = make_remote(tmp_path, [f"{k}.glb" for k in range(4)] + ["plane.glb"])
+    tmp_dir = str(tmp_path / "cache")
+    jobs = [{"model_file": path, "plane_file": paths[-1]} for path in paths[:-1]]
+    fetch = functools.partial(
+        mfd.download_if_on_manifold, tmp_dir=tmp_dir, max_bytes=0, backend=backend, pin=True
+    )
+    release = functools.partial(mfd.release_if_on_manifold, tmp_dir=tmp_dir)
+    cache = mfd.get_blob_cache(tmp_dir)
+
+    with rjobs.AssetPrefetcher(jobs, fetch, lookahead=2, release=release) as prefetcher:
+        for idx, job in enumerate(jobs):
+            prefetcher.prefetch(idx)
+            resolved = prefetcher.resolve(job)
+            # with a zero budget only the pins keep the files of the running job
+            cache.evict()
+            assert os.path.exists(resolved["model_file"])
+            assert os.path.exists(resolved["plane_file"])
+            prefetcher.finish(idx)
+            cache.evict()
+            assert not os.path.exists(cache.path(job["model_file"]))
+    cache.evict()
+    assert cache.total_bytes() == 0
+
+
+
+def test_asset_prefetcher_resolves_only_the_given_keys(tmp_path):
+    backend, paths = make_remote(tmp_path, ["plane.glb"])
+    tmp_dir = str(tmp_path / "cache")
+    fetch = functools.partial(
+        mfd.download_if_on_manifold, tmp_dir=tmp_dir, backend=backend, pin=True
+    )
+    # the base config of a batch, its model_file is a default that does not exist here
+    config = {"model_file": "/Users/someone/model.glb", "plane_file": paths[0]}
+
+    release = functools.partial(mfd.release_if_on_manifold, tmp_dir=tmp_dir)
+
+    with rjobs.AssetPrefetcher([], fetch, release=release) as prefetcher:
+        resolved = prefetcher.resolve(config, ["plane_file", "bg_file"])
+        assert resolved["model_file"] == config["model_file"]
+        assert os.path.exists(resolved["plane_file"])
+        assert list(prefetcher.futures) == [paths[0]]
+    # released on close, nothing stays pinned
+    assert mfd.get_blob_cache(tmp_dir)._pins == {}
+
+class FlakyBackend(mfd.LocalDirBackend):
+    # fails the first failures puts, then behaves
+    def __init__(self, root, failures):
+        super().__init__(root)
+        self.failures = failures
+
+    def put(self, local_file, remote_path):
+        if self.failures > 0:
+            self.failures -= 1
+            raise OSError("connection reset")
+        super().put(local_file, remote_path)
+
+
+def test_uploader_forgets_errors_of_retried_files(tmp_path):
+    backend = FlakyBackend(str(tmp_path / "remote"), failures=1)
+    local_dir = str(tmp_path / "out")
+    uploader = mfd.StreamingUploader(
+        local_dir, "manifold://bucket/out", backend, poll_seconds=60, settle_seconds=0
+    )
+    with open(os.path.join(local_dir, "0.png"), "wb") as f:
+        f.write(b"png")
+    uploader.flush()
+    assert list(uploader.errors) == ["0.png"]
+
+    # the final scan of close() queues the file again, it has nothing to complain about
+    uploader.close()
+    assert uploader.errors == {}
+    assert backend.exists("manifold://bucket/out/0.png")
+
+
+def test_manifold_uploader_uploads_on_exit_of_the_with_block(tmp_path):
+    backend = mfd.LocalDirBackend(str(tmp_path / "remote"))
+    with mfd.ManifoldUploader("manifold://bucket/out", str(tmp_path), backend=backend) as uploader:
+        with open(os.path.join(uploader.local_dir, "0.png"), "wb") as f:
+            f.write(b"png")
+    assert backend.exists("manifold://bucket/out/0.png")
+
+
+def test_local_dir_backend_round_trip(tmp_path):
+    backend = mfd.LocalDirBackend(str(tmp_path / "remote"))
+    src = tmp_path / "a.txt"
+    src.write_text("hello")
+
+    assert not backend.exists("manifold://bucket/dir/a.txt")
+    backend.put(str(src), "manifold://bucket/dir/a.txt")
+    assert backend.exists("manifold://bucket/dir/a.txt")
+    backend.get("manifold://bucket/dir/a.txt", str(tmp_path / "b.txt"))
+    assert (tmp_path / "b.txt").read_text() == "hello"
+
+    pairs = [(str(src), f"manifold://bucket/many/{k}.txt") for k in range(10)]
+    backend.put_many(pairs)
+    backend.get_many(
+        [(remote_path, str(tmp_path / f"{k}.txt")) for k, (_, remote_path) in enumerate(pairs)]
+    )
+    assert all((tmp_path / f"{k}.txt").read_text() == "hello" for k in range(10))
+
+
+def test_storage_backend_requires_the_single_file_methods():
+    class GetOnlyBackend(mfd.StorageBackend):
+        def get(self, remote_path, dest_file):
+            pass
+
+    try:
+        GetOnlyBackend()
+        assert False, "expected a TypeError"
+    except TypeError as e:
+        assert "put" in str(e)
+
+
+def test_retry_with_backoff_retries_io_errors_only():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise OSError("connection reset")
+        return "done"
+
+    assert mfd.retry_with_backoff(flaky, retries=3, base_delay=0) == "done"
+    assert len(calls) == 3
+
+    calls.clear()
+    try:
+        mfd.retry_with_backoff(flaky, retries=1, base_delay=0)
+        assert False, "expected the last OSError"
+    except OSError:
+        pass
+    assert len(calls) == 2
+
+    def bug():
+        calls.append(1)
+        raise KeyError("bug")
+
+    calls.clear()
+    try:
+        mfd.retry_with_backoff(bug, retries=3, base_delay=0)
+        assert False, "expected the KeyError"
+    except KeyError:
+        pass
+    assert len(calls) == 1
+
+
+def test_run_args_raises_command_error(tmp_path):
+    try:
+        mfd.run_args(["ls", str(tmp_path / "missing")], retries=1)
+        assert False, "expected a CommandError"
+    except mfd.CommandError as e:
+        assert "missing" in str(e)
@@ -1,10 +1,19 @@
+import json
 import os
+from collections import OrderedDict
 from typing import Any, Dict, List, Union  # noqa
 
 import bpy
 import numpy as np
 from mathutils import Matrix, Vector  # noqa
 
+from . import cache_util as cutil
+from . import glb_util
+from . import video_util
+
+# set by enable_import_cache, load_object then goes through the .blend cache
+_import_cache = {"dir": None, "max_bytes": None}
+
 
 def add_camera(location=(0.0, 0.0, 0.0), _type="PERSP") -> bpy.types.Object:
     assert _type in ["PERSP", "ORTHO", "PANO"]
@@ -33,6 +42,78 @@ def get_lookat_transfrom(location: Vector, target: Vector) -> Matrix:
     return transform_matrix  # a.k.a. obj.matrix_world
 
 
+def get_lookat_transforms(locations: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    Vectorized get_lookat_transfrom: (N, 3) locations and (N, 3) or (3,) targets to
+    (N, 4, 4) world matrices looking down -Z at the target with +Y up.
+    """
+    locations = np.asarray(locations, dtype=np.float64).reshape(-1, 3)
+    targets = np.broadcast_to(np.asarray(targets, dtype=np.float64), locations.shape)
+    z = locations - targets
+    z = z / np.linalg.norm(z, axis=1, keepdims=True)
+    x = np.cross([0.0, 0.0, 1.0], z)
+    norm = np.linalg.norm(x, axis=1, keepdims=True)
+    # looking straight up or down, keep x along the world x axis
+    degenerate = norm[:, 0] < 1e-9
+    x[degenerate] = [1.0, 0.0, 0.0]
+    norm[degenerate] = 1.0
+    x = x / norm
+    y = np.cross(z, x)
+
+    matrices = np.zeros((len(locations), 4, 4))
+    matrices[:, :3, 0] = x
+    matrices[:, :3, 1] = y
+    matrices[:, :3, 2] = z
+    matrices[:, :3, 3] = locations
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+
+def rotation_matrices_to_quaternions(rotations: np.ndarray, continuous: bool = True) -> np.ndarray:
+    """
+    (N, 3, 3) or (N, 4, 4) rotation matrices to (N, 4) unit quaternions in blender's
+    (w, x, y, z) order. With continuous the sign of each quaternion is flipped to the
+    hemisphere of the previous one, so keyframed rotations interpolate the short way.
+    """
+    R = np.asarray(rotations, dtype=np.float64)[..., :3, :3].reshape(-1, 3, 3)
+    m00, m11, m22 = R[:, 0, 0], R[:, 1, 1], R[:, 2, 2]
+    # Shepperd: solve for the largest of w, x, y, z, the division by it stays well conditioned
+    candidates = np.stack(
+        [m00 + m11 + m22, m00 - m11 - m22, -m00 + m11 - m22, -m00 - m11 + m22], axis=1
+    )
+    k = np.argmax(candidates, axis=1)
+    s = 2.0 * np.sqrt(np.maximum(1.0 + candidates[np.arange(len(R)), k], 1e-12))
+
+    q = np.empty((len(R), 4))
+    d21, d02, d10 = R[:, 2, 1] - R[:, 1, 2], R[:, 0, 2] - R[:, 2, 0], R[:, 1, 0] - R[:, 0, 1]
+    s21, s02, s10 = R[:, 2, 1] + R[:, 1, 2], R[:, 0, 2] + R[:, 2, 0], R[:, 1, 0] + R[:, 0, 1]
+    for idx, w, x, y, z in [
+        (0, s / 4, d21 / s, d02 / s, d10 / s),
+        (1, d21 / s, s / 4, s10 / s, s02 / s),
+        (2, d02 / s, s10 / s, s / 4, s21 / s),
+        (3, d10 / s, s02 / s, s21 / s, s / 4),
+    ]:
+        mask = k == idx
+        q[mask] = np.stack([w, x, y, z], axis=1)[mask]
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+
+    if continuous and len(q) > 1:
+        flips = np.sign(np.einsum("ij,ij->i", q[1:], q[:-1]))
+        flips[flips == 0] = 1.0
+        q[1:] *= np.cumprod(flips)[:, None]
+    return q
+
+
+def get_lookat_poses(locations, targets=(0.0, 0.0, 0.0)):
+    """
+    Batch set_camera_lookat: (N, 3) locations, e.g. the output of
+    trajectory_gen.generate_spiral_trajectory, and (N, 3) or (3,) targets to
+    (N, 4, 4) world matrices and (N, 4) rotation quaternions (w, x, y, z).
+    """
+    matrices = get_lookat_transforms(locations, targets)
+    return matrices, rotation_matrices_to_quaternions(matrices)
+
+
 def set_camera_lookat(obj: bpy.types.Object, location: Vector, target: Vector) -> None:
     d = location - target
     rotation_quat = d.to_track_quat("Z", "Y")
@@ -41,6 +122,43 @@ def set_camera_lookat(obj: bpy.types.Object, location: Vector, target: Vector) -
     obj.location = location
 
 
+def set_keyframes(
+    id_data, data_path: str, samples: np.ndarray, index: int = 0, interpolation: str = "LINEAR"
+) -> List[bpy.types.FCurve]:
+    """
+    Bulk keyframe_insert: samples are (N, 2) (frame, value) rows for the array element
+    index of data_path, or (N, 1 + C) rows with a value column for each of the elements
+    index, index + 1, ... The fcurves are replaced and filled with foreach_set, one call
+    per curve instead of one RNA lookup and fcurve update per frame. data_path is relative
+    to id_data, e.g. socket.path_from_id("default_value") with id_data=node_tree.
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    samples = samples.reshape(len(samples), -1)
+    num = len(samples)
+    anim = id_data.animation_data or id_data.animation_data_create()
+    if anim.action is None:
+        anim.action = bpy.data.actions.new(f"{id_data.name}Action")
+    fcurves = anim.action.fcurves
+    # foreach_set writes enums as their integer value
+    interpolation_value = bpy.types.Keyframe.bl_rna.properties["interpolation"].enum_items[
+        interpolation
+    ].value
+
+    result = []
+    for k in range(samples.shape[1] - 1):
+        fcurve = fcurves.find(data_path, index=index + k)
+        if fcurve is not None:
+            fcurves.remove(fcurve)
+        fcurve = fcurves.new(data_path, index=index + k)
+        fcurve.keyframe_points.add(num)
+        co = np.stack([samples[:, 0], samples[:, k + 1]], axis=1).astype(np.float32)
+        fcurve.keyframe_points.foreach_set("co", co.ravel())
+        fcurve.keyframe_points.foreach_set("interpolation", [interpolation_value] * num)
+        fcurve.update()  # sorts the points and recalculates the handles
+        result.append(fcurve)
+    return result
+
+
 def add_light(
     location=(0.0, 0.0, 0.0), _type="POINT", energy=1.0, color=(1.0, 1.0, 1.0)
 ) -> bpy.types.Object:
@@ -89,6 +207,54 @@ def render_still(
     bpy.ops.render.render(write_still=True)
 
 
+def calibration_to_camera_params(
+    K: np.ndarray,
+    image_width: int,
+    image_height: int,
+    sensor_fit: str = "AUTO",
+    sensor_width: float = 36.0,
+    sensor_height: float = 24.0,
+) -> Dict[str, Any]:
+    """
+    Blender camera settings of (3, 3) or (N, 3, 3) calibration matrices, vectorized.
+    lens, shift_x and shift_y have one value per matrix, sensor_fit and the pixel aspect
+    are render wide settings, so all matrices must share fx / fy.
+    """
+    K = np.asarray(K, dtype=np.float64).reshape(-1, 3, 3)
+    assert np.all(np.abs(K[:, 0, 1]) < 1e-7), "Skew is not supported by Blender yet"
+
+    fx, fy = K[:, 0, 0], K[:, 1, 1]  # focal length in pixels
+    cx, cy = K[:, 0, 2], K[:, 1, 2]  # principal point in pixels
+
+    pixel_aspect_ratio = fx[0] / fy[0]  # dy / dx
+    assert np.allclose(fx / fy, pixel_aspect_ratio), "fx / fy must be the same for all frames"
+
+    # Determine the sensor fit mode to use, which aspect of sensor is larger
+    fit = sensor_fit
+    if fit == "AUTO":
+        fit = "HORIZONTAL" if image_width / fx[0] >= image_height / fy[0] else "VERTICAL"
+
+    # Based on the sensor fit mode, determine the longer view aspect in pixels
+    if fit == "HORIZONTAL":
+        view_fac_in_px = image_width
+    else:
+        view_fac_in_px = pixel_aspect_ratio * image_height
+    sensor_size_in_mm = sensor_height if sensor_fit == "VERTICAL" else sensor_width
+
+    # Convert focal length in px to focal length in mm
+    lens = fx * sensor_size_in_mm / view_fac_in_px
+    assert np.all(lens >= 1), "The focal length is smaller than 1mm which is not allowed in blender"
+
+    return {
+        "lens": lens,
+        # principal point
+        "shift_x": (cx - (image_width - 1) / 2) / -view_fac_in_px,
+        "shift_y": (cy - (image_height - 1) / 2) / view_fac_in_px * pixel_aspect_ratio,
+        "pixel_aspect_x": fy[0] / fx[0] if fx[0] < fy[0] else 1.0,
+        "pixel_aspect_y": fx[0] / fy[0] if fx[0] > fy[0] else 1.0,
+    }
+
+
 def set_camera_intrinsics_from_calibration_matrix(
     K: np.ndarray, image_width: int, image_height: int
 ):
@@ -101,57 +267,328 @@ def set_camera_intrinsics_from_calibration_matrix(
     """
     cam_ob = bpy.context.scene.camera
     cam = cam_ob.data
+    params = calibration_to_camera_params(
+        K, image_width, image_height, cam.sensor_fit, cam.sensor_width, cam.sensor_height
+    )
 
-    assert abs(K[0][1]) < 1e-7, "Skew is not supported by Blender yet"
+    cam.lens_unit = "MILLIMETERS"
+    cam.lens = params["lens"][0]
+    cam.shift_x = params["shift_x"][0]
+    cam.shift_y = params["shift_y"][0]
 
-    fx, fy = K[0][0], K[1][1]  # focal length in pixels
-    cx, cy = K[0][2], K[1][2]  # principal point in pixels
+    # Set aspect ratio
+    bpy.context.scene.render.pixel_aspect_x = params["pixel_aspect_x"]
+    bpy.context.scene.render.pixel_aspect_y = params["pixel_aspect_y"]
 
-    pixel_aspect_ratio = fx / fy  # dy / dx
+    bpy.context.scene.render.resolution_x = image_width
+    bpy.context.scene.render.resolution_y = image_height
 
-    # Determine the sensor fit mode to use
-    if cam.sensor_fit == "AUTO":
-        # determine which aspect of sensor is larger
-        if image_width / fx >= image_height / fy:
-            sensor_fit = "HORIZONTAL"
-        else:
-            sensor_fit = "VERTICAL"
-    else:
-        sensor_fit = cam.sensor_fit
 
-    # Based on the sensor fit mode, determine the longer view aspect in pixels
-    if sensor_fit == "HORIZONTAL":
+# camera data settings the calibration setters change, see save_camera_state
+_CAMERA_STATE_KEYS = [
+    "lens_unit",
+    "lens",
+    "shift_x",
+    "shift_y",
+    "sensor_fit",
+    "sensor_width",
+    "sensor_height",
+]
+
+
+def save_camera_state(cam_ob: bpy.types.Object) -> Dict[str, Any]:
+    """
+    Intrinsics of the camera and pixel aspect of the scene, to undo a per job camera setup
+    (e.g. set_camera_sequence_from_calibration) with restore_camera_state.
+    """
+    state = {key: getattr(cam_ob.data, key) for key in _CAMERA_STATE_KEYS}
+    render = bpy.context.scene.render
+    state["pixel_aspect"] = (render.pixel_aspect_x, render.pixel_aspect_y)
+    return state
+
+
+def restore_camera_state(cam_ob: bpy.types.Object, state: Dict[str, Any]) -> None:
+    # the sensor before the lens, the angle follows from both
+    for key in _CAMERA_STATE_KEYS[::-1]:
+        setattr(cam_ob.data, key, state[key])
+    render = bpy.context.scene.render
+    render.pixel_aspect_x, render.pixel_aspect_y = state["pixel_aspect"]
+
+
+# opencv cameras look down +Z with +Y down, blender cameras down -Z with +Y up
+OPENCV_TO_BLENDER_CAMERA = np.diag([1.0, -1.0, -1.0, 1.0])
+EXTRINSICS_CONVENTIONS = ["opencv_w2c", "opencv_c2w", "blender_c2w"]
+
+
+def extrinsics_to_blender_c2w(extrinsics: np.ndarray, convention: str = "opencv_w2c") -> np.ndarray:
+    """
+    (N, 4, 4) camera extrinsics to blender camera matrix_world, (N, 4, 4).
+    """
+    assert convention in EXTRINSICS_CONVENTIONS, f"unknown convention {convention}"
+    matrices = np.asarray(extrinsics, dtype=np.float64).reshape(-1, 4, 4)
+    if convention == "opencv_w2c":
+        matrices = np.linalg.inv(matrices)
+    if convention.startswith("opencv"):
+        matrices = matrices @ OPENCV_TO_BLENDER_CAMERA
+    return matrices
+
+
+def set_camera_sequence_from_calibration(
+    Ks: np.ndarray,
+    extrinsics: np.ndarray,
+    image_width: int,
+    image_height: int,
+    convention: str = "opencv_w2c",
+    frame_start: int = 0,
+    cam_ob: bpy.types.Object = None,
+) -> None:
+    """
+    Keyframe the scene camera through a captured sequence: frame frame_start + i gets the
+    intrinsics Ks[i] (N, 3, 3) and the pose extrinsics[i] (N, 4, 4), so all views render
+    as one animation (with persistent data) instead of one process per view. The keys are
+    constant, frames in between hold the previous view.
+    """
+    cam_ob = cam_ob or bpy.context.scene.camera
+    cam = cam_ob.data
+    params = calibration_to_camera_params(
+        Ks, image_width, image_height, cam.sensor_fit, cam.sensor_width, cam.sensor_height
+    )
+    matrices = extrinsics_to_blender_c2w(extrinsics, convention)
+    assert len(matrices) == len(params["lens"]), "one calibration matrix per extrinsics"
+    frames = frame_start + np.arange(len(matrices))[:, None]
+
+    cam.lens_unit = "MILLIMETERS"
+    for data_path in ["lens", "shift_x", "shift_y"]:
+        samples = np.hstack([frames, params[data_path][:, None]])
+        set_keyframes(cam, data_path, samples, interpolation="CONSTANT")
+    bpy.context.scene.render.pixel_aspect_x = params["pixel_aspect_x"]
+    bpy.context.scene.render.pixel_aspect_y = params["pixel_aspect_y"]
+
+    cam_ob.parent = None
+    cam_ob.rotation_mode = "QUATERNION"
+    quaternions = rotation_matrices_to_quaternions(matrices)
+    samples = np.hstack([frames, matrices[:, :3, 3]])
+    set_keyframes(cam_ob, "location", samples, interpolation="CONSTANT")
+    samples = np.hstack([frames, quaternions])
+    set_keyframes(cam_ob, "rotation_quaternion", samples, interpolation="CONSTANT")
+
+    bpy.context.scene.frame_start = frame_start
+    bpy.context.scene.frame_end = frame_start + len(matrices) - 1
+
+    bpy.context.scene.render.resolution_x = image_width
+    bpy.context.scene.render.resolution_y = image_height
+
+
+def camera_params_to_calibration(
+    lens: np.ndarray,
+    shift_x: np.ndarray,
+    shift_y: np.ndarray,
+    image_width: int,
+    image_height: int,
+    sensor_fit: str = "AUTO",
+    sensor_width: float = 36.0,
+    sensor_height: float = 24.0,
+    pixel_aspect_x: float = 1.0,
+    pixel_aspect_y: float = 1.0,
+) -> np.ndarray:
+    """
+    Inverse of calibration_to_camera_params: (N,) lens and shifts to (N, 3, 3) K matrices.
+    """
+    lens, shift_x, shift_y = np.broadcast_arrays(
+        *[np.atleast_1d(np.asarray(x, dtype=np.float64)) for x in [lens, shift_x, shift_y]]
+    )
+    pixel_aspect_ratio = pixel_aspect_y / pixel_aspect_x  # fx / fy
+
+    fit = sensor_fit
+    if fit == "AUTO":
+        fit = "HORIZONTAL" if image_width >= image_height * pixel_aspect_ratio else "VERTICAL"
+    if fit == "HORIZONTAL":
         view_fac_in_px = image_width
     else:
         view_fac_in_px = pixel_aspect_ratio * image_height
-    sensor_size_in_mm = (
-        cam.sensor_height if cam.sensor_fit == "VERTICAL" else cam.sensor_width
+    sensor_size_in_mm = sensor_height if sensor_fit == "VERTICAL" else sensor_width
+
+    fx = lens * view_fac_in_px / sensor_size_in_mm
+    K = np.zeros((len(lens), 3, 3))
+    K[:, 0, 0] = fx
+    K[:, 1, 1] = fx / pixel_aspect_ratio
+    K[:, 0, 2] = (image_width - 1) / 2 - shift_x * view_fac_in_px
+    K[:, 1, 2] = (image_height - 1) / 2 + shift_y * view_fac_in_px / pixel_aspect_ratio
+    K[:, 2, 2] = 1.0
+    return K
+
+
+def sample_fcurves(id_data, data_path: str, frames: np.ndarray, default) -> np.ndarray:
+    """
+    (N, C) values of the animated property data_path at frames, read from the keyframes
+    with foreach_get. Components without an fcurve keep default (the current value).
+    Constant curves are sampled as steps, all others linearly, which is exact at the
+    keyed frames (every frame for the turntables here), drivers and modifiers are ignored.
+    """
+    frames = np.asarray(frames, dtype=np.float64)
+    default = np.atleast_1d(np.asarray(default, dtype=np.float64))
+    values = np.tile(default, (len(frames), 1))
+    anim = id_data.animation_data
+    if anim is None or anim.action is None:
+        return values
+
+    constant = bpy.types.Keyframe.bl_rna.properties["interpolation"].enum_items["CONSTANT"].value
+    for k in range(len(default)):
+        fcurve = anim.action.fcurves.find(data_path, index=k)
+        if fcurve is None or len(fcurve.keyframe_points) == 0:
+            continue
+        points = fcurve.keyframe_points
+        co = np.empty(2 * len(points), dtype=np.float32)
+        points.foreach_get("co", co)
+        co = co.reshape(-1, 2)
+        interpolation = np.empty(len(points), dtype=np.int32)
+        points.foreach_get("interpolation", interpolation)
+        if np.all(interpolation == constant):
+            idx = np.clip(np.searchsorted(co[:, 0], frames, side="right") - 1, 0, None)
+            values[:, k] = co[idx, 1]
+        else:
+            values[:, k] = np.interp(frames, co[:, 0], co[:, 1])
+    return values
+
+
+def euler_xyz_to_matrices(eulers: np.ndarray) -> np.ndarray:
+    ex, ey, ez = np.asarray(eulers, dtype=np.float64).reshape(-1, 3).T
+    cx, sx, cy, sy, cz, sz = np.cos(ex), np.sin(ex), np.cos(ey), np.sin(ey), np.cos(ez), np.sin(ez)
+    # Rz @ Ry @ Rx, blender's XYZ order
+    return np.stack(
+        [
+            np.stack([cy * cz, sx * sy * cz - cx * sz, cx * sy * cz + sx * sz], axis=1),
+            np.stack([cy * sz, sx * sy * sz + cx * cz, cx * sy * sz - sx * cz], axis=1),
+            np.stack([-sy, sx * cy, cx * cy], axis=1),
+        ],
+        axis=1,
     )
 
-    # Convert focal length in px to focal length in mm
-    f_in_mm = fx * sensor_size_in_mm / view_fac_in_px
-    assert (
-        f_in_mm >= 1
-    ), "The focal length is smaller than 1mm which is not allowed in blender"
 
-    cam.lens_unit = "MILLIMETERS"
-    cam.lens = f_in_mm
+def quaternions_to_matrices(quaternions: np.ndarray) -> np.ndarray:
+    q = np.asarray(quaternions, dtype=np.float64).reshape(-1, 4)
+    w, x, y, z = (q / np.linalg.norm(q, axis=1, keepdims=True)).T
+    return np.stack(
+        [
+            np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], axis=1),
+            np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], axis=1),
+            np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis=1),
+        ],
+        axis=1,
+    )
 
-    # principal point
-    cam.shift_x = (cx - (image_width - 1) / 2) / -view_fac_in_px
-    cam.shift_y = (cy - (image_height - 1) / 2) / view_fac_in_px * pixel_aspect_ratio
 
-    # Set aspect ratio
-    pixel_aspect_y = fx / fy if fx > fy else 1.0
-    pixel_aspect_x = fy / fx if fx < fy else 1.0
-    bpy.context.scene.render.pixel_aspect_x = pixel_aspect_x
-    bpy.context.scene.render.pixel_aspect_y = pixel_aspect_y
+def get_object_matrices(obj: bpy.types.Object, frames: np.ndarray) -> np.ndarray:
+    """
+    (N, 4, 4) matrix_world of obj at frames, composed from the sampled location,
+    rotation and scale keyframes. Parented or constrained objects and the other rotation
+    modes fall back to frame_set per frame.
+    """
+    frames = np.asarray(frames)
+    if obj.parent or obj.constraints or obj.rotation_mode not in ["XYZ", "QUATERNION"]:
+        scene = bpy.context.scene
+        current = scene.frame_current
+        matrices = []
+        for frame in frames:
+            scene.frame_set(int(frame))
+            matrices.append(np.array(obj.matrix_world))
+        scene.frame_set(current)
+        return np.array(matrices)
+
+    locations = sample_fcurves(obj, "location", frames, obj.location)
+    scales = sample_fcurves(obj, "scale", frames, obj.scale)
+    if obj.rotation_mode == "QUATERNION":
+        q = sample_fcurves(obj, "rotation_quaternion", frames, obj.rotation_quaternion)
+        rotations = quaternions_to_matrices(q)
+    else:
+        rotations = euler_xyz_to_matrices(
+            sample_fcurves(obj, "rotation_euler", frames, obj.rotation_euler)
+        )
+    matrices = np.zeros((len(frames), 4, 4))
+    matrices[:, :3, :3] = rotations * scales[:, None, :]
+    matrices[:, :3, 3] = locations
+    matrices[:, 3, 3] = 1.0
+    return matrices
 
-    bpy.context.scene.render.resolution_x = image_width
-    bpy.context.scene.render.resolution_y = image_height
+
+def get_camera_intrinsics(cam_ob: bpy.types.Object, frames: np.ndarray) -> np.ndarray:
+    """
+    (N, 3, 3) K matrices of the camera at frames, for the scene render resolution.
+    """
+    cam = cam_ob.data
+    render = bpy.context.scene.render
+    scale = render.resolution_percentage / 100
+    return camera_params_to_calibration(
+        sample_fcurves(cam, "lens", frames, cam.lens)[:, 0],
+        sample_fcurves(cam, "shift_x", frames, cam.shift_x)[:, 0],
+        sample_fcurves(cam, "shift_y", frames, cam.shift_y)[:, 0],
+        int(render.resolution_x * scale),
+        int(render.resolution_y * scale),
+        cam.sensor_fit,
+        cam.sensor_width,
+        cam.sensor_height,
+        render.pixel_aspect_x,
+        render.pixel_aspect_y,
+    )
+
+
+def save_transforms(
+    npz_file: str,
+    cam_ob: bpy.types.Object,
+    frames: np.ndarray = None,
+    model_obj: bpy.types.Object = None,
+    normalization: np.ndarray = None,
+) -> None:
+    """
+    Write the camera of every frame to one npz: "frames" (N,), "c2w" (N, 4, 4) blender
+    camera to world (the camera looks down -Z, +Y up), "K" (N, 3, 3) in pixels and
+    "image_size" (width, height). With model_obj also its per-frame "model_matrix"
+    (N, 4, 4), with normalization the (4, 4) "normalization" of the loaded model.
+    Frames default to the scene frame range.
+    """
+    scene = bpy.context.scene
+    if frames is None:
+        frames = np.arange(scene.frame_start, scene.frame_end + 1)
+    scale = scene.render.resolution_percentage / 100
+    arrays = {
+        "frames": np.asarray(frames),
+        "c2w": get_object_matrices(cam_ob, frames),
+        "K": get_camera_intrinsics(cam_ob, frames),
+        "image_size": np.array(
+            [int(scene.render.resolution_x * scale), int(scene.render.resolution_y * scale)]
+        ),
+    }
+    if model_obj is not None:
+        arrays["model_matrix"] = get_object_matrices(model_obj, frames)
+    if normalization is not None:
+        arrays["normalization"] = np.array(normalization)
+
+    # write then rename, the chunks of a sharded job all write the same file
+    os.makedirs(os.path.dirname(os.path.abspath(npz_file)), exist_ok=True)
+    with open(npz_file + ".tmp", "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(npz_file + ".tmp", npz_file)
+
+
+def enable_import_cache(cache_dir: str, max_bytes: int = 20 << 30) -> None:
+    """
+    Make load_object convert each glTF file to a .blend once (keyed by the file content)
+    and append from it afterwards. Least recently used entries are evicted beyond max_bytes.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    _import_cache["dir"] = cache_dir
+    _import_cache["max_bytes"] = max_bytes
+
+
+def disable_import_cache() -> None:
+    _import_cache["dir"] = None
 
 
 def load_object(scene_file_path: str) -> bpy.types.Object:
+    if _import_cache["dir"]:
+        return load_object_cached(
+            scene_file_path, _import_cache["dir"], _import_cache["max_bytes"]
+        )
     print("Loading scene: " + scene_file_path)
     bpy.ops.import_scene.gltf(filepath=scene_file_path)
     obj = bpy.context.selected_objects[0]
@@ -160,10 +597,245 @@ def load_object(scene_file_path: str) -> bpy.types.Object:
     return obj
 
 
+def load_object_geometry(scene_file_path: str) -> bpy.types.Object:
+    """
+    Geometry only replacement for load_object, e.g. for depth/normal passes. The GLB
+    buffers are read with numpy and all meshes are baked into a single object,
+    materials and images are skipped. Files the numpy reader does not support
+    (other formats, draco, ...) go through load_object.
+    """
+    print("Loading geometry: " + scene_file_path)
+    try:
+        verts, tris = glb_util.load_glb_geometry(scene_file_path)
+    except glb_util.UnsupportedGlbError as e:
+        print(f"{e}, falling back to the importer")
+        return load_object(scene_file_path)
+    name = os.path.splitext(os.path.basename(scene_file_path))[0]
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(verts))
+    mesh.vertices.foreach_set("co", verts.ravel())
+    mesh.loops.add(tris.size)
+    mesh.loops.foreach_set("vertex_index", tris.ravel())
+    mesh.polygons.add(len(tris))
+    mesh.polygons.foreach_set("loop_start", np.arange(0, tris.size, 3, dtype=np.int32))
+    if not mesh.polygons.bl_rna.properties["loop_total"].is_readonly:  # blender < 4.0
+        mesh.polygons.foreach_set("loop_total", np.full(len(tris), 3, dtype=np.int32))
+    mesh.update(calc_edges=True)
+    mesh.validate()
+
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.collection.objects.link(obj)
+    bpy.ops.object.select_all(action="DESELECT")
+    obj.select_set(True)
+    bpy.context.view_layer.objects.active = obj
+    print("model loaded: ", obj.name)
+    assert isinstance(obj, bpy.types.Object)
+    return obj
+
+
+def load_object_cached(
+    scene_file_path: str, cache_dir: str, max_bytes: int, link: bool = False
+) -> bpy.types.Object:
+    """
+    Same contract as load_object. link=True links the objects from the cached library
+    instead of appending them, they are then read only (no normalize_object).
+    """
+    key = cutil.file_hash(scene_file_path)
+    blend_file = os.path.join(cache_dir, key + ".blend")
+    info_file = os.path.join(cache_dir, key + ".json")
+
+    if os.path.exists(blend_file) and os.path.exists(info_file):
+        with open(info_file) as f:
+            info = json.load(f)
+        os.utime(blend_file)  # mark as recently used
+        print("Loading cached scene: " + blend_file)
+        before = snapshot_datablocks()
+        with bpy.data.libraries.load(blend_file, link=link) as (data_from, data_to):
+            data_to.objects = info["objects"]
+        # the cache is written with fake users, appended ones would survive the cleanup
+        # of remove_datablocks_since and purge_orphans and pile up across jobs
+        for attr, ids in before.items():
+            for id_data in getattr(bpy.data, attr):
+                if id_data not in ids and id_data.library is None:
+                    id_data.use_fake_user = False
+
+        bpy.ops.object.select_all(action="DESELECT")
+        for obj in data_to.objects:
+            bpy.context.collection.objects.link(obj)
+            obj.select_set(True)
+        obj = data_to.objects[0]
+        bpy.context.view_layer.objects.active = obj
+        print("model loaded: ", obj.name)
+        assert isinstance(obj, bpy.types.Object)
+        return obj
+
+    objects_before = set(bpy.data.objects)
+    images_before = set(bpy.data.images)
+    disable_import_cache()
+    try:
+        obj = load_object(scene_file_path)
+    finally:
+        _import_cache["dir"] = cache_dir
+
+    # the first object is the one load_object returns
+    new_objects = [obj] + [o for o in bpy.data.objects if o not in objects_before and o != obj]
+    for img in bpy.data.images:
+        if img not in images_before and img.source == "FILE" and not img.packed_file:
+            img.pack()
+
+    tmp_file = f"{blend_file}.{os.getpid()}.tmp"
+    bpy.data.libraries.write(tmp_file, set(new_objects), fake_user=True)
+    os.replace(tmp_file, blend_file)
+    with open(f"{info_file}.{os.getpid()}.tmp", "w") as f:
+        json.dump({"source": scene_file_path, "objects": [o.name for o in new_objects]}, f)
+    os.replace(f"{info_file}.{os.getpid()}.tmp", info_file)
+
+    cutil.evict_lru(cache_dir, max_bytes)
+    return obj
+
+
+# datablocks created by a model import (and the passes rendered from it)
+_MODEL_DATABLOCK_TYPES = [
+    "objects",
+    "meshes",
+    "materials",
+    "images",
+    "textures",
+    "node_groups",
+    "actions",
+    "armatures",
+    "cameras",
+    "lights",
+    "curves",
+    "collections",
+]
+
+
+def snapshot_datablocks() -> Dict[str, set]:
+    return {attr: set(getattr(bpy.data, attr)) for attr in _MODEL_DATABLOCK_TYPES}
+
+
+def remove_datablocks_since(snapshot: Dict[str, set]) -> int:
+    """
+    Remove every datablock created after snapshot_datablocks() was taken, so that
+    the shared part of the scene stays untouched between batched jobs. Datablocks
+    with a fake user (e.g. hdr_pool images) are kept for the following jobs.
+    """
+    new_ids = []
+    for attr, ids in snapshot.items():
+        new_ids.extend(
+            id_data
+            for id_data in getattr(bpy.data, attr)
+            if id_data not in ids and not id_data.use_fake_user
+        )
+    bpy.data.batch_remove(new_ids)
+    return len(new_ids)
+
+
+def purge_orphans() -> int:
+    """
+    Remove every datablock without users (fake users count), recursively: a removed mesh
+    releases its materials, which release their images, and so on.
+    """
+    if hasattr(bpy.data, "orphans_purge"):  # blender >= 3.0
+        return bpy.data.orphans_purge(do_local_ids=True, do_linked_ids=True, do_recursive=True)
+    removed = 0
+    while True:
+        orphans = [
+            id_data
+            for attr in _MODEL_DATABLOCK_TYPES + ["worlds"]
+            for id_data in getattr(bpy.data, attr)
+            if id_data.users == 0 and not id_data.use_fake_user
+        ]
+        if not orphans:
+            return removed
+        bpy.data.batch_remove(orphans)
+        removed += len(orphans)
+
+
+def reset_scene(keep: List[bpy.types.Object] = None) -> int:
+    """
+    Remove all objects of the scene except keep (and their children) through the data
+    API, independent of the context and selection, then purge the orphaned meshes,
+    materials, images, actions, ... Datablocks with a fake user (hdr_pool) survive.
+    """
+    keep = set(get_object_hierarchy(keep or []))
+    objects = [obj for obj in bpy.context.scene.objects if obj not in keep]
+    bpy.data.batch_remove(objects)
+    return len(objects) + purge_orphans()
+
+
+class HdrPool:
+    """
+    Decoded environment images shared across jobs, keyed by path. Images are kept with
+    a fake user (remove_datablocks_since leaves them alone) and the least recently used
+    ones are removed once the decoded pixels exceed max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = 2 << 30):
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()  # path -> image name
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def image_bytes(image: bpy.types.Image) -> int:
+        width, height = image.size
+        return width * height * image.channels * (4 if image.is_float else 1)
+
+    def total_bytes(self) -> int:
+        return sum(self.image_bytes(bpy.data.images[name]) for name in self.images.values())
+
+    def get(self, img_path: str) -> bpy.types.Image:
+        path = os.path.abspath(img_path)
+        name = self.images.get(path)
+        if name is not None and name in bpy.data.images:
+            self.hits += 1
+            self.images.move_to_end(path)
+            return bpy.data.images[name]
+
+        self.misses += 1
+        image = bpy.data.images.load(path, check_existing=True)
+        image.use_fake_user = True
+        self.images[path] = image.name
+        self.evict(keep=image.name)
+        return image
+
+    def evict(self, keep: str = None) -> None:
+        # drop entries removed behind our back, then the least recently used
+        self.images = OrderedDict(
+            (path, name) for path, name in self.images.items() if name in bpy.data.images
+        )
+        total = self.total_bytes()
+        for path, name in list(self.images.items()):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            image = bpy.data.images[name]
+            total -= self.image_bytes(image)
+            print(f"hdr pool: evicting {path}")
+            bpy.data.images.remove(image)
+            del self.images[path]
+
+    def clear(self) -> None:
+        for name in self.images.values():
+            if name in bpy.data.images:
+                bpy.data.images.remove(bpy.data.images[name])
+        self.images.clear()
+
+
+hdr_pool = HdrPool()
+
+
 def set_world_background_hdr(
     img_path: str, strength: float = 1.0, rotation_euler: List = None
 ):
-
+    """
+    Light the world with an environment image. The node chain is created on the first
+    call and reused afterwards, only the image (from hdr_pool) and settings are swapped.
+    """
     if not rotation_euler:
         rotation_euler = [0.0, 0.0, 0.0]
 
@@ -178,17 +850,18 @@ def set_world_background_hdr(
     background_node = nodes["Background"]
     background_node.inputs["Strength"].default_value = strength
 
-    texture_node = nodes.new(type="ShaderNodeTexEnvironment")
-    texture_node.image = bpy.data.images.load(img_path, check_existing=True)
+    texture_node = get_or_new_node(nodes, "ShaderNodeTexEnvironment", "HDR Environment")
+    texture_node.image = hdr_pool.get(img_path)
 
     links.new(texture_node.outputs["Color"], background_node.inputs["Color"])
 
     # add UV mapping to apply rotation
-    mapping_node = nodes.new("ShaderNodeMapping")
-    tex_coords_node = nodes.new("ShaderNodeTexCoord")
+    mapping_node = get_or_new_node(nodes, "ShaderNodeMapping", "HDR Mapping")
+    tex_coords_node = get_or_new_node(nodes, "ShaderNodeTexCoord", "HDR Coordinates")
     links.new(tex_coords_node.outputs["Generated"], mapping_node.inputs["Vector"])
     links.new(mapping_node.outputs["Vector"], texture_node.inputs["Vector"])
     mapping_node.inputs["Rotation"].default_value = rotation_euler
+    return mapping_node
 
 
 def get_scene_meshes():
@@ -203,30 +876,87 @@ def get_scene_root_objects():
             yield obj
 
 
-def get_scene_bbox():
-    meshes = [
-        obj
-        for obj in bpy.context.scene.objects.values()
-        if isinstance(obj.data, bpy.types.Mesh)
+# object types with geometry, others (empties, cameras, lights) have no extent
+GEOMETRY_TYPES = ["MESH", "CURVE", "SURFACE", "FONT", "META"]
+BBOX_MODES = ["exact", "fast"]
+
+
+def get_object_hierarchy(objects) -> List[bpy.types.Object]:
+    result = {}
+    for obj in objects:
+        result[obj.name] = obj
+        for child in obj.children_recursive:
+            result[child.name] = child
+    return list(result.values())
+
+
+def get_objects_bbox(objects, mode: str = "exact"):
+    """
+    World space bbox (min, max) of the objects and their children. "exact" reads all
+    evaluated vertices (modifiers, shape keys applied) with foreach_get and transforms
+    them with one matmul per object, "fast" transforms the 8 bound_box corners of all
+    objects at once, a looser box for rotated objects.
+    """
+    assert mode in BBOX_MODES, f"unknown bbox mode {mode}"
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    objects = [
+        obj.evaluated_get(depsgraph)
+        for obj in get_object_hierarchy(objects)
+        if obj.type in GEOMETRY_TYPES
     ]
-    assert len(meshes) > 0, "No mesh found in the scene"
-    bbox_min = None
-    bbox_max = None
-    for obj in meshes:
-        for v in obj.bound_box:
-            v = obj.matrix_world @ Vector(v)
-            bbox_max = np.maximum(bbox_max, v) if bbox_max is not None else v
-            bbox_min = np.minimum(bbox_min, v) if bbox_min is not None else v
+    assert len(objects) > 0, "No geometry found"
+
+    if mode == "fast":
+        corners = np.array([np.array(obj.bound_box) for obj in objects])  # (M, 8, 3)
+        matrices = np.array([np.array(obj.matrix_world) for obj in objects])
+        world = np.einsum("mij,mkj->mki", matrices[:, :3, :3], corners)
+        world = (world + matrices[:, None, :3, 3]).reshape(-1, 3)
+        return world.min(axis=0), world.max(axis=0)
+
+    bbox_min = np.full(3, np.inf)
+    bbox_max = np.full(3, -np.inf)
+    for obj in objects:
+        mesh = obj.data if obj.type == "MESH" else obj.to_mesh()
+        if len(mesh.vertices) > 0:
+            co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+            mesh.vertices.foreach_get("co", co)
+            matrix = np.array(obj.matrix_world, dtype=np.float32)
+            world = co.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]
+            bbox_min = np.minimum(bbox_min, world.min(axis=0))
+            bbox_max = np.maximum(bbox_max, world.max(axis=0))
+        if obj.type != "MESH":
+            obj.to_mesh_clear()
+    assert np.all(np.isfinite(bbox_min)), "No vertices found"
     return bbox_min, bbox_max
 
 
-def normalize_scene():
-    bbox_min, bbox_max = get_scene_bbox()
+def get_scene_bbox(mode: str = "exact"):
+    meshes = list(get_scene_meshes())
+    assert len(meshes) > 0, "No mesh found in the scene"
+    return get_objects_bbox(meshes, mode)
+
+
+def normalize_objects(objects, mode: str = "exact") -> np.ndarray:
+    """
+    Scale and center the objects (with their children) into the unit cube at the origin.
+    Returns the applied (4, 4) world transform.
+    """
+    bbox_min, bbox_max = get_objects_bbox(objects, mode)
     scale = 1 / max(bbox_max - bbox_min)
     offset = -(bbox_min + bbox_max) / 2
-    for obj in get_scene_root_objects():
-        T = Matrix.Diagonal([scale, scale, scale, 1.0]) @ Matrix.Translation(offset)
-        obj.matrix_world = T @ obj.matrix_world
+    T = np.diag([scale, scale, scale, 1.0])
+    T[:3, 3] = scale * offset
+
+    # children follow their parent
+    hierarchy = get_object_hierarchy(objects)
+    for obj in hierarchy:
+        if obj.parent not in hierarchy:
+            obj.matrix_world = Matrix((T @ np.array(obj.matrix_world)).tolist())
+    return T
+
+
+def normalize_scene(mode: str = "exact"):
+    return normalize_objects(list(get_scene_root_objects()), mode)
 
 
 def get_nodes_by_idname(nodes, idname: str):
@@ -280,51 +1010,398 @@ def get_shader_node_input_link(
     return input.links[0]
 
 
-def setup_base_color_rendering(obj: bpy.types.Object) -> bool:
-    principled = get_principled_bsdf_node(obj)
-    if not principled:
-        print("Failed to get principled BSDF node")
-        return False
-    link = get_shader_node_input_link(principled, "Base Color")
-    if not link:
-        print("Failed to get base color link")
-        return False
-    if not obj.active_material or not obj.active_material.node_tree:
-        print("Not active material or not using node")
-        return False
-    tree = obj.active_material.node_tree
-    output_node = tree.nodes.new(type="ShaderNodeOutputMaterial")
-    tree.links.new(link.from_socket, output_node.inputs[0])
-    output_node.is_active_output = True
-    return True
-
-
-def setup_metallic_roughness_rendering(obj: bpy.types.Object) -> bool:
-    principled = get_principled_bsdf_node(obj)
-    if not principled:
-        print("Failed to get principled BSDF node")
-        return False
-    metallic_link = get_shader_node_input_link(principled, "Metallic")
-    if not metallic_link:
-        print("Failed to get base metallic link")
-        return False
-
-    roughness_link = get_shader_node_input_link(principled, "Roughness")
-    if not roughness_link:
-        print("Failed to get base roughness link")
-        return False
-
-    if not obj.active_material or not obj.active_material.node_tree:
-        print("Not active material or not using node")
-        return False
-    tree = obj.active_material.node_tree
-    output_node = tree.nodes.new(type="ShaderNodeOutputMaterial")
-
-    combine_color_node = tree.nodes.new(type="ShaderNodeCombineColor")
-    tree.links.new(combine_color_node.outputs[0], output_node.inputs[0])
-    tree.links.new(metallic_link.from_socket, combine_color_node.inputs["Red"])
-    tree.links.new(roughness_link.from_socket, combine_color_node.inputs["Green"])
-    tree.links.new(combine_color_node.outputs[0], output_node.inputs[0])
-    output_node.is_active_output = True
-
-    return True
+AOV_ALBEDO = "albedo"
+AOV_METALLIC_ROUGHNESS = "metallic_roughness"
+
+
+def setup_base_color_rendering(
+    obj: bpy.types.Object, switcher: "MaterialPassSwitcher" = None
+) -> bool:
+    # the surface of every material shows the base color, see MaterialPassSwitcher
+    # pass the switcher of the model to reuse its node lookups and restore() it later
+    return (switcher or MaterialPassSwitcher(obj)).switch(AOV_ALBEDO)
+
+
+def setup_metallic_roughness_rendering(
+    obj: bpy.types.Object, switcher: "MaterialPassSwitcher" = None
+) -> bool:
+    # the surface of every material shows metallic (R) and roughness (G)
+    return (switcher or MaterialPassSwitcher(obj)).switch(AOV_METALLIC_ROUGHNESS)
+
+
+class MaterialPassSwitcher:
+    """
+    Switch all principled materials of an object (and its children) between the beauty
+    surface and the albedo / metallic-roughness channels. The pass outputs are named
+    nodes created on first use, switching only flips the active material output, so it
+    can be repeated without growing the node trees and restore() brings the beauty back.
+    """
+
+    OUTPUT_NAMES = {
+        AOV_ALBEDO: "Pass Albedo Output",
+        AOV_METALLIC_ROUGHNESS: "Pass Metallic Roughness Output",
+    }
+
+    def __init__(self, obj: bpy.types.Object):
+        # material -> name of the output node of each pass, looked up once
+        self.outputs = {}
+        for mat in get_object_materials(obj):
+            if not mat.use_nodes:
+                continue
+            principled = get_nodes_by_idname(mat.node_tree.nodes, "ShaderNodeBsdfPrincipled")
+            beauty = self.get_beauty_output(mat)
+            if not principled or beauty is None:
+                continue
+            self.outputs[mat] = self.add_pass_outputs(mat, principled[0])
+            self.outputs[mat]["beauty"] = beauty.name
+        if not self.outputs:
+            print("no principled BSDF material found")
+
+    @classmethod
+    def get_beauty_output(cls, mat: bpy.types.Material) -> Union[bpy.types.Node, None]:
+        outputs = [
+            node
+            for node in get_nodes_by_idname(mat.node_tree.nodes, "ShaderNodeOutputMaterial")
+            if node.name not in cls.OUTPUT_NAMES.values()
+        ]
+        active = [node for node in outputs if node.is_active_output]
+        return (active or outputs or [None])[0]
+
+    @classmethod
+    def add_pass_outputs(cls, mat: bpy.types.Material, principled) -> Dict[str, str]:
+        tree = mat.node_tree
+        nodes = tree.nodes
+
+        albedo_output = get_or_new_node(
+            nodes, "ShaderNodeOutputMaterial", cls.OUTPUT_NAMES[AOV_ALBEDO]
+        )
+        base_color = principled.inputs["Base Color"]
+        if base_color.is_linked:
+            tree.links.new(base_color.links[0].from_socket, albedo_output.inputs["Surface"])
+        else:
+            # a shader input has no default value, hold the constant color in a node
+            color_node = get_or_new_node(nodes, "ShaderNodeRGB", "Pass Albedo Color")
+            color_node.outputs[0].default_value = base_color.default_value
+            tree.links.new(color_node.outputs[0], albedo_output.inputs["Surface"])
+
+        mr_output = get_or_new_node(
+            nodes, "ShaderNodeOutputMaterial", cls.OUTPUT_NAMES[AOV_METALLIC_ROUGHNESS]
+        )
+        combine_color_node = get_or_new_node(
+            nodes, "ShaderNodeCombineColor", "Pass Metallic Roughness"
+        )
+        link_or_copy_input(tree, principled.inputs["Metallic"], combine_color_node.inputs["Red"])
+        link_or_copy_input(
+            tree, principled.inputs["Roughness"], combine_color_node.inputs["Green"]
+        )
+        tree.links.new(combine_color_node.outputs[0], mr_output.inputs["Surface"])
+        return dict(cls.OUTPUT_NAMES)
+
+    def switch(self, pass_name: str) -> bool:
+        """
+        Make pass_name ("beauty", AOV_ALBEDO or AOV_METALLIC_ROUGHNESS) the active output
+        of every material. Returns False if the object has no principled material.
+        """
+        for mat, outputs in self.outputs.items():
+            nodes = mat.node_tree.nodes
+            for node_name in outputs.values():
+                nodes[node_name].is_active_output = False
+            nodes[outputs[pass_name]].is_active_output = True
+        return len(self.outputs) > 0
+
+    def restore(self) -> None:
+        self.switch("beauty")
+
+
+def get_object_materials(obj: bpy.types.Object) -> List[bpy.types.Material]:
+    # glTF imports are often an empty with the meshes as children
+    materials = []
+    for o in [obj] + list(obj.children_recursive):
+        for slot in o.material_slots:
+            if slot.material and slot.material not in materials:
+                materials.append(slot.material)
+    return materials
+
+
+def get_or_new_node(nodes, idname: str, name: str) -> bpy.types.Node:
+    node = nodes.get(name)
+    if node is None:
+        node = nodes.new(type=idname)
+        node.name = name
+    return node
+
+
+def link_or_copy_input(tree, src_input, dst_input) -> None:
+    # feed dst from whatever drives src, its default value if nothing does
+    if src_input.is_linked:
+        tree.links.new(src_input.links[0].from_socket, dst_input)
+    else:
+        dst_input.default_value = src_input.default_value
+
+
+# file_format, color_depth, color_mode of each pass written by setup_pass_outputs
+PASS_FORMATS = {
+    "beauty": ("PNG", "8", "RGBA"),
+    AOV_ALBEDO: ("PNG", "8", "RGBA"),
+    AOV_METALLIC_ROUGHNESS: ("OPEN_EXR", "16", "RGB"),
+    "depth": ("OPEN_EXR", "32", "BW"),
+    "normal": ("OPEN_EXR", "16", "RGB"),
+}
+PASS_SOCKETS = {"beauty": "Image", "depth": "Depth", "normal": "Normal"}
+
+# file_format, color_depth of the depth output modes, "NPY" is written by DepthNpyWriter
+DEPTH_FORMATS = {"EXR16": ("OPEN_EXR", "16"), "EXR32": ("OPEN_EXR", "32"), "NPY": None}
+
+
+class DepthNpyWriter:
+    """
+    Save the depth pass of every rendered frame as <depth_dir>/<frame>.npy (float32, H x W,
+    row 0 at the top). The depth is routed to the compositor Viewer node and read back
+    in a render_post handler, so it also works in background mode.
+    """
+
+    def __init__(self, depth_dir: str):
+        self.depth_dir = depth_dir
+        os.makedirs(depth_dir, exist_ok=True)
+
+    def __call__(self, scene, *args):
+        img = bpy.data.images.get("Viewer Node")
+        if img is None or img.size[0] == 0:
+            print("no depth in the viewer node for frame ", scene.frame_current)
+            return
+        w, h = img.size
+        pixels = np.empty(w * h * 4, dtype=np.float32)
+        img.pixels.foreach_get(pixels)
+        depth = pixels.reshape(h, w, 4)[::-1, :, 0]
+        np.save(os.path.join(self.depth_dir, f"{scene.frame_current:04d}.npy"), depth)
+
+    def register(self) -> None:
+        # one writer at a time, a writer left over from a previous job would write its
+        # depth into that job's directory
+        DepthNpyWriter.unregister_all()
+        bpy.app.handlers.render_post.append(self)
+
+    def unregister(self) -> None:
+        if self in bpy.app.handlers.render_post:
+            bpy.app.handlers.render_post.remove(self)
+
+    @staticmethod
+    def unregister_all() -> None:
+        for handler in list(bpy.app.handlers.render_post):
+            if isinstance(handler, DepthNpyWriter):
+                bpy.app.handlers.render_post.remove(handler)
+
+
+def add_depth_output(
+    tree, render_layer_node, depth_dir: str, depth_format: str = "EXR32"
+) -> Union[bpy.types.Node, DepthNpyWriter]:
+    """
+    Write the float depth pass per frame as a half ("EXR16") or full ("EXR32") float EXR
+    into depth_dir, or as raw float32 .npy ("NPY", see DepthNpyWriter).
+    Read a whole sequence back with depth_io.load_depth_sequence.
+    """
+    assert depth_format in DEPTH_FORMATS, f"unknown depth format: {depth_format}"
+    bpy.context.view_layer.use_pass_z = True
+
+    if depth_format == "NPY":
+        viewer_node = get_or_new_node(tree.nodes, "CompositorNodeViewer", "Depth Viewer")
+        viewer_node.use_alpha = False
+        tree.links.new(render_layer_node.outputs["Depth"], viewer_node.inputs["Image"])
+        tree.nodes.active = viewer_node
+        writer = DepthNpyWriter(depth_dir)
+        writer.register()
+        return writer
+
+    file_format, color_depth = DEPTH_FORMATS[depth_format]
+    depth_output_node = tree.nodes.new("CompositorNodeOutputFile")
+    depth_output_node.base_path = depth_dir
+    depth_output_node.format.file_format = file_format
+    depth_output_node.format.color_depth = color_depth
+    depth_output_node.format.color_mode = "BW"
+    tree.links.new(render_layer_node.outputs["Depth"], depth_output_node.inputs["Image"])
+    return depth_output_node
+
+
+def setup_material_aovs(obj: bpy.types.Object) -> bool:
+    """
+    Add AOV outputs for the base color (albedo) and metallic/roughness (R/G) to every
+    principled material of the object. The surface output is left alone, so the beauty
+    and the material channels come out of the same render.
+    """
+    view_layer = bpy.context.view_layer
+    for name in [AOV_ALBEDO, AOV_METALLIC_ROUGHNESS]:
+        if name not in [aov.name for aov in view_layer.aovs]:
+            aov = view_layer.aovs.add()
+            aov.name = name
+            aov.type = "COLOR"
+
+    found = False
+    for mat in get_object_materials(obj):
+        if not mat.use_nodes:
+            continue
+        principled = get_nodes_by_idname(mat.node_tree.nodes, "ShaderNodeBsdfPrincipled")
+        if not principled:
+            continue
+        principled = principled[0]
+        tree = mat.node_tree
+
+        albedo_node = get_or_new_node(tree.nodes, "ShaderNodeOutputAOV", "AOV " + AOV_ALBEDO)
+        combine_node = get_or_new_node(tree.nodes, "ShaderNodeCombineColor", "AOV combine MR")
+        mr_node = get_or_new_node(
+            tree.nodes, "ShaderNodeOutputAOV", "AOV " + AOV_METALLIC_ROUGHNESS
+        )
+        for node, name in [(albedo_node, AOV_ALBEDO), (mr_node, AOV_METALLIC_ROUGHNESS)]:
+            if hasattr(node, "aov_name"):
+                node.aov_name = name
+            else:  # blender < 3.0
+                node.name = name
+
+        link_or_copy_input(tree, principled.inputs["Base Color"], albedo_node.inputs["Color"])
+        link_or_copy_input(tree, principled.inputs["Metallic"], combine_node.inputs["Red"])
+        link_or_copy_input(tree, principled.inputs["Roughness"], combine_node.inputs["Green"])
+        tree.links.new(combine_node.outputs[0], mr_node.inputs["Color"])
+        found = True
+
+    if not found:
+        print("no principled BSDF material found")
+    return found
+
+
+PASS_OUTPUT_NODE = "Pass Output"
+
+
+def remove_pass_outputs() -> None:
+    # stop writing the passes set up by setup_pass_outputs, e.g. for the next job of a batch
+    tree = bpy.context.scene.node_tree
+    if tree and tree.nodes.get(PASS_OUTPUT_NODE):
+        tree.nodes.remove(tree.nodes[PASS_OUTPUT_NODE])
+    DepthNpyWriter.unregister_all()
+
+
+def setup_pass_outputs(
+    result_dir: str, passes: List[str], multilayer: bool = False, depth_format: str = "EXR32"
+) -> bpy.types.Node:
+    """
+    Write the given passes of every rendered frame with one compositor File Output node:
+    "beauty", "albedo", "metallic_roughness" (see setup_material_aovs), "depth", "normal".
+    Each pass goes to <result_dir>/<pass>/<frame>.<ext>, or with multilayer=True all of
+    them go into one multilayer EXR per frame in <result_dir>/passes/.
+    depth_format is one of DEPTH_FORMATS, "NPY" writes the depth outside of the File Output node.
+    """
+    scene = bpy.context.scene
+    scene.render.use_compositing = True
+    scene.use_nodes = True
+    tree = scene.node_tree
+    view_layer = bpy.context.view_layer
+    if "depth" in passes:
+        view_layer.use_pass_z = True
+    if "normal" in passes:
+        view_layer.use_pass_normal = True
+
+    render_layer_node = get_nodes_by_idname(tree.nodes, "CompositorNodeRLayers")[0]
+
+    # start from a fresh node, the slots and the directory of a previous job may differ,
+    # before the depth writer below, this drops the writer of a previous job as well
+    remove_pass_outputs()
+
+    if "depth" in passes and depth_format == "NPY" and not multilayer:
+        writer = add_depth_output(
+            tree, render_layer_node, os.path.join(result_dir, "depth"), "NPY"
+        )
+        assert writer in bpy.app.handlers.render_post, "NPY depth writer not registered"
+        passes = [p for p in passes if p != "depth"]
+
+    output_node = tree.nodes.new("CompositorNodeOutputFile")
+    output_node.name = PASS_OUTPUT_NODE
+
+    if multilayer:
+        output_node.base_path = os.path.join(result_dir, "passes", "")
+        output_node.format.file_format = "OPEN_EXR_MULTILAYER"
+        output_node.format.color_depth = "32"
+        output_node.layer_slots.clear()
+        for p in passes:
+            output_node.layer_slots.new(p)
+    else:
+        output_node.base_path = result_dir
+        output_node.file_slots.clear()
+        for p in passes:
+            output_node.file_slots.new(os.path.join(p, ""))
+            slot = output_node.file_slots[-1]
+            slot.use_node_format = False
+            file_format, color_depth, color_mode = PASS_FORMATS[p]
+            if p == "depth":
+                file_format, color_depth = DEPTH_FORMATS[depth_format]
+            slot.format.file_format = file_format
+            slot.format.color_depth = color_depth
+            slot.format.color_mode = color_mode
+
+    for k, p in enumerate(passes):
+        tree.links.new(render_layer_node.outputs[PASS_SOCKETS.get(p, p)], output_node.inputs[k])
+    return output_node
+
+
+def linear_to_srgb(x: np.ndarray) -> np.ndarray:
+    x = np.clip(x, 0.0, 1.0)
+    return np.where(x <= 0.0031308, x * 12.92, 1.055 * np.power(x, 1 / 2.4) - 0.055)
+
+
+def read_viewer_pixels() -> np.ndarray:
+    """
+    (H, W, 4) float32 pixels of the compositor Viewer node, row 0 at the top. Unlike
+    the Render Result these are accessible in background mode.
+    """
+    img = bpy.data.images["Viewer Node"]
+    w, h = img.size
+    pixels = np.empty(w * h * 4, dtype=np.float32)
+    img.pixels.foreach_get(pixels)
+    return pixels.reshape(h, w, 4)[::-1]
+
+
+def render_frames_to_video(output_file: str, fps: int = 24, keep_frames_dir: str = None) -> None:
+    """
+    Render the scene frame range and push every frame into an ffmpeg pipe as soon as it
+    is rendered, no image sequence touches the disk unless keep_frames_dir is given.
+    The composite is read from the Viewer node (scene linear) and encoded with the sRGB
+    transfer, the view transform is therefore "Standard" while rendering.
+    """
+    scene = bpy.context.scene
+    scene.render.use_compositing = True
+    scene.use_nodes = True
+    tree = scene.node_tree
+    if any(isinstance(handler, DepthNpyWriter) for handler in bpy.app.handlers.render_post):
+        raise ValueError("the Viewer node is taken by the NPY depth output")
+
+    # show whatever goes into the composite output
+    render_layer_node = get_nodes_by_idname(tree.nodes, "CompositorNodeRLayers")[0]
+    source = render_layer_node.outputs["Image"]
+    composite_nodes = get_nodes_by_idname(tree.nodes, "CompositorNodeComposite")
+    if composite_nodes and composite_nodes[0].inputs["Image"].is_linked:
+        source = composite_nodes[0].inputs["Image"].links[0].from_socket
+    viewer_node = get_or_new_node(tree.nodes, "CompositorNodeViewer", "Stream Viewer")
+    tree.links.new(source, viewer_node.inputs["Image"])
+    tree.nodes.active = viewer_node
+
+    width = scene.render.resolution_x * scene.render.resolution_percentage // 100
+    height = scene.render.resolution_y * scene.render.resolution_percentage // 100
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    if keep_frames_dir:
+        os.makedirs(keep_frames_dir, exist_ok=True)
+
+    # restored afterwards, the following jobs of a batch render with the scene's look
+    view_transform = scene.view_settings.view_transform
+    scene.view_settings.view_transform = "Standard"
+    try:
+        with video_util.FFmpegPipeWriter(output_file, width, height, fps) as writer:
+            for frame in range(scene.frame_start, scene.frame_end + 1):
+                scene.frame_set(frame)
+                bpy.ops.render.render()
+                # premultiplied alpha, dropping it composites over black
+                rgb = linear_to_srgb(read_viewer_pixels()[..., :3])
+                writer.write((rgb * 255 + 0.5).astype(np.uint8))
+                if keep_frames_dir:
+                    bpy.data.images["Render Result"].save_render(
+                        os.path.join(keep_frames_dir, f"{frame:04d}.png")
+                    )
+    finally:
+        scene.view_settings.view_transform = view_transform
+
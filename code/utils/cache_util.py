@@ -0,0 +1,278 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict
+
+# config keys that only say where or which part to render, they never change a pixel
+_RENDER_KEY_IGNORED = [
+    "name",
+    "save_dir",
+    "frame_start",
+    "frame_end",
+    "cache_dir",
+    "render_cache_max_bytes",
+    "import_cache_dir",
+    "import_cache_max_bytes",
+    "hdr_pool_max_bytes",
+    "download_dir",
+    "download_max_bytes",
+    "prefetch_jobs",
+    "keep_frames",
+    "profile",
+]
+_RENDER_KEY_FILES = ["model_file", "plane_file", "bg_file", "camera_file"]
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def dict_hash(d: Dict) -> str:
+    return hashlib.md5(json.dumps(d, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def render_cache_key(config: Dict, blender_version: str, renderer_version: int) -> str:
+    """
+    Hash of everything that determines the rendered pixels: the content of the input
+    files (not their paths), the normalized config and the renderer versions.
+    """
+    inputs = {k: v for k, v in config.items() if k not in _RENDER_KEY_IGNORED}
+    for k in _RENDER_KEY_FILES:
+        if k in inputs and os.path.isfile(inputs[k]):
+            inputs[k] = file_hash(inputs[k])
+    inputs["blender_version"] = blender_version
+    inputs["renderer_version"] = renderer_version
+    return dict_hash(inputs)
+
+
+def copy_or_link(src: str, dest: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:  # cross device or no hard link support
+        shutil.copyfile(src, dest)
+
+
+def evict_lru(cache_dir: str, max_bytes: int) -> None:
+    """
+    Remove the least recently used entries until cache_dir (and its subdirectories)
+    fits in max_bytes. Files of a directory sharing the part of the name before the
+    first "." form one entry, the newest modification time of its files is the last use.
+    """
+    entries = {}
+    for root, _, files in os.walk(cache_dir):
+        for file in files:
+            if ".tmp" in file:
+                continue
+            path = os.path.join(root, file)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # evicted by another process
+                continue
+            key = os.path.join(root, file.split(".")[0])
+            paths, size, mtime = entries.get(key, ([], 0, 0.0))
+            entries[key] = (paths + [path], size + stat.st_size, max(mtime, stat.st_mtime))
+
+    total = sum(size for _, size, _ in entries.values())
+    for paths, size, _ in sorted(entries.values(), key=lambda entry: entry[2]):
+        if total <= max_bytes:
+            break
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+
+
+class RenderCache:
+    """
+    Content addressed cache of rendered outputs, one entry per frame. Every put evicts
+    the least recently used entries beyond max_bytes, a hit counts as a use.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 20 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def frame_key(job_key: str, frame) -> str:
+        return hashlib.md5(f"{job_key}:{frame}".encode()).hexdigest()
+
+    def path(self, key: str, ext: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ext)
+
+    def get(self, key: str, dest: str) -> bool:
+        path = self.path(key, os.path.splitext(dest)[1])
+        if not os.path.exists(path):
+            return False
+        os.utime(path)  # mark as recently used
+        copy_or_link(path, dest)
+        return True
+
+    def put(self, key: str, src: str) -> None:
+        path = self.path(key, os.path.splitext(src)[1])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # copy then rename, a concurrent reader never sees a partial entry
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, path)
+        evict_lru(self.cache_dir, self.max_bytes)
+
+
+class BlobCache:
+    """
+    Local LRU cache of remote files under a byte budget, shared by the worker processes
+    of a node. Blobs are written to a temp file and renamed, so a failed download never
+    counts as a hit. An sqlite index keeps size, md5 and last use of every blob, a lock
+    file per key makes concurrent misses on the same file download it once.
+    Blobs still in use are pinned (see pin) and never evicted.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 20 << 30, verify: bool = False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.verify = verify  # re-check the md5 on every hit, not only the size
+        self._pins = {}  # key -> open pin files, one per pin() of this process
+        self._pins_lock = threading.Lock()
+        os.makedirs(os.path.join(cache_dir, "locks"), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, "pins"), exist_ok=True)
+        self.index_file = os.path.join(cache_dir, "index.sqlite")
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS blobs (key TEXT PRIMARY KEY, source TEXT,"
+                " file TEXT, size INTEGER, md5 TEXT, last_used REAL)"
+            )
+
+    def _connect(self):
+        # a short lived connection per operation, safe to use after fork
+        db = sqlite3.connect(self.index_file, timeout=60, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        return contextlib.closing(db)
+
+    @staticmethod
+    def key(source: str) -> str:
+        return hashlib.md5(source.encode()).hexdigest()
+
+    def path(self, source: str) -> str:
+        key = self.key(source)
+        # keep the extension, importers dispatch on it
+        return os.path.join(self.cache_dir, key[:2], key + os.path.splitext(source)[1])
+
+    def _pin_file(self, key: str) -> str:
+        return os.path.join(self.cache_dir, "pins", key)
+
+    def pin(self, source: str) -> None:
+        """
+        Keep source in the cache until release(source), pins nest. A pin is a shared lock
+        on a file per key, evict() skips the keys it cannot lock exclusively, so the pins
+        of all processes count and those of a crashed process go away with it.
+        """
+        key = self.key(source)
+        pin_file = open(self._pin_file(key), "a")
+        fcntl.flock(pin_file, fcntl.LOCK_SH)
+        with self._pins_lock:
+            self._pins.setdefault(key, []).append(pin_file)
+
+    def release(self, source: str) -> None:
+        key = self.key(source)
+        with self._pins_lock:
+            pin_files = self._pins.get(key)
+            if not pin_files:
+                return
+            pin_file = pin_files.pop()
+            if not pin_files:
+                del self._pins[key]
+        pin_file.close()
+
+    def _lookup(self, db, key: str, file: str) -> bool:
+        row = db.execute("SELECT size, md5 FROM blobs WHERE key = ?", (key,)).fetchone()
+        if row is None or not os.path.exists(file) or os.path.getsize(file) != row[0]:
+            return False
+        if self.verify and file_hash(file) != row[1]:
+            print(f"blob cache: checksum mismatch, fetching again: {file}")
+            return False
+        db.execute("UPDATE blobs SET last_used = ? WHERE key = ?", (time.time(), key))
+        return True
+
+    def get(self, source: str, fetch: Callable[[str, str], None], pin: bool = False) -> str:
+        """
+        Local path of source, fetch(source, dest_file) downloads it on a miss. With pin
+        the blob stays until release(source), otherwise a later get may evict it.
+        """
+        if pin:
+            # before the lookup, an eviction in between would remove the hit
+            self.pin(source)
+            try:
+                return self.get(source, fetch)
+            except Exception:
+                self.release(source)
+                raise
+
+        key = self.key(source)
+        file = self.path(source)
+        with self._connect() as db:
+            if self._lookup(db, key, file):
+                return file
+
+        with open(os.path.join(self.cache_dir, "locks", key), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            with self._connect() as db:
+                # another process may have fetched it while we waited for the lock
+                if self._lookup(db, key, file):
+                    return file
+                os.makedirs(os.path.dirname(file), exist_ok=True)
+                tmp_file = f"{file}.{os.getpid()}.tmp"
+                try:
+                    fetch(source, tmp_file)
+                    size = os.path.getsize(tmp_file)
+                    md5 = file_hash(tmp_file)
+                    os.replace(tmp_file, file)
+                finally:
+                    if os.path.exists(tmp_file):
+                        os.remove(tmp_file)
+                db.execute(
+                    "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, source, file, size, md5, time.time()),
+                )
+        self.evict(keep=key)
+        return file
+
+    def evict(self, keep: str = None) -> None:
+        # least recently used first, pinned blobs and keep stay even if over budget
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            rows = db.execute("SELECT key, file, size FROM blobs ORDER BY last_used").fetchall()
+            total = sum(size for _, _, size in rows)
+            for key, file, size in rows:
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                with open(self._pin_file(key), "a") as pin_file:
+                    try:
+                        # held while removing, a concurrent pin() waits and then misses
+                        fcntl.flock(pin_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    db.execute("DELETE FROM blobs WHERE key = ?", (key,))
+                    if os.path.exists(file):
+                        os.remove(file)
+                total -= size
+            db.execute("COMMIT")
+
+    def total_bytes(self) -> int:
+        with self._connect() as db:
+            return db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
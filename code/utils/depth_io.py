@@ -0,0 +1,68 @@
+import os
+from typing import List
+
+import numpy as np
+
+SEQUENCE_FILE = "depth_sequence.npy"
+
+
+def list_depth_files(depth_dir: str) -> List[str]:
+    files = [f for f in os.listdir(depth_dir) if f.endswith((".npy", ".exr")) and f != SEQUENCE_FILE]
+    # frames are numbered, "10.exr" must come after "9.exr"
+    files.sort(key=lambda f: (len(os.path.splitext(f)[0]), f))
+    return [os.path.join(depth_dir, f) for f in files]
+
+
+def read_exr_depth(path: str) -> np.ndarray:
+    # opencv only decodes EXR when enabled before it is imported
+    os.environ.setdefault("OPENCV_IO_ENABLE_OPENEXR", "1")
+    import cv2
+
+    depth = cv2.imread(path, cv2.IMREAD_ANYDEPTH | cv2.IMREAD_ANYCOLOR)
+    assert depth is not None, f"failed to read {path}"
+    if depth.ndim == 3:
+        depth = depth[..., 0]
+    return depth
+
+
+def read_depth(path: str) -> np.ndarray:
+    if path.endswith(".npy"):
+        return np.load(path)
+    return read_exr_depth(path)
+
+
+def load_depth_sequence(path: str, dtype=np.float32) -> np.ndarray:
+    """
+    Memory map the depth of a whole rendered sequence as one (frames, H, W) array.
+    path is either a .npy sequence file or a depth folder of per-frame .npy/.exr files.
+    A folder is decoded once into <path>/depth_sequence.npy, later calls only map it
+    (it is rebuilt when frames are added or change).
+    """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+
+    files = list_depth_files(path)
+    assert files, f"no depth frames found in {path}"
+    sequence_file = os.path.join(path, SEQUENCE_FILE)
+    if os.path.exists(sequence_file):
+        sequence = np.load(sequence_file, mmap_mode="r")
+        newest = max(os.path.getmtime(f) for f in files)
+        if (
+            len(sequence) == len(files)
+            and sequence.dtype == dtype
+            and os.path.getmtime(sequence_file) >= newest
+        ):
+            return sequence
+
+    first = read_depth(files[0])
+    tmp_file = f"{sequence_file}.{os.getpid()}.tmp.npy"
+    sequence = np.lib.format.open_memmap(
+        tmp_file, mode="w+", dtype=dtype, shape=(len(files),) + first.shape
+    )
+    sequence[0] = first
+    for k, f in enumerate(files[1:], start=1):
+        sequence[k] = read_depth(f)
+    sequence.flush()
+    del sequence
+    os.replace(tmp_file, sequence_file)
+    return np.load(sequence_file, mmap_mode="r")
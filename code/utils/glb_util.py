@@ -0,0 +1,161 @@
+import json
+import struct
+from typing import Dict, Iterator, Tuple
+
+import numpy as np
+
+GLB_MAGIC = 0x46546C67  # "glTF"
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+
+COMPONENT_DTYPES = {
+    5120: np.int8,
+    5121: np.uint8,
+    5122: np.int16,
+    5123: np.uint16,
+    5125: np.uint32,
+    5126: np.float32,
+}
+TYPE_SIZES = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4, "MAT2": 4, "MAT3": 9, "MAT4": 16}
+
+class UnsupportedGlbError(ValueError):
+    """
+    A valid file the numpy reader cannot handle (not a GLB, sparse accessors, external
+    buffers, draco), callers fall back to the blender importer.
+    """
+
+
+# glTF is +Y up, blender is +Z up: (x, y, z) -> (x, -z, y), same as the glTF importer
+Y_UP_TO_Z_UP = np.array([[1, 0, 0], [0, 0, -1], [0, 1, 0]], dtype=np.float64)
+
+
+def read_glb(path: str) -> Tuple[Dict, np.ndarray]:
+    """
+    Return the glTF json and the binary chunk, the latter memory mapped from the file.
+    """
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    if len(data) < 12 or struct.unpack_from("<I", data, 0)[0] != GLB_MAGIC:
+        raise UnsupportedGlbError(f"not a GLB file: {path}")
+    magic, version, length = struct.unpack_from("<III", data, 0)
+    assert version == 2, f"unsupported GLB version {version}: {path}"
+
+    gltf = None
+    bin_chunk = None
+    offset = 12
+    while offset < length:
+        chunk_length, chunk_type = struct.unpack_from("<II", data, offset)
+        chunk = data[offset + 8 : offset + 8 + chunk_length]
+        if chunk_type == CHUNK_JSON:
+            gltf = json.loads(chunk.tobytes())
+        elif chunk_type == CHUNK_BIN and bin_chunk is None:
+            bin_chunk = chunk
+        offset += 8 + chunk_length
+    assert gltf is not None, f"GLB without json chunk: {path}"
+    return gltf, bin_chunk
+
+
+def get_accessor_array(gltf: Dict, bin_chunk: np.ndarray, accessor_idx: int) -> np.ndarray:
+    """
+    (count, components) array of an accessor, a strided view into the binary chunk
+    (no copy) unless the accessor is normalized.
+    """
+    accessor = gltf["accessors"][accessor_idx]
+    if "sparse" in accessor:
+        raise UnsupportedGlbError("sparse accessors are not supported")
+    dtype = np.dtype(COMPONENT_DTYPES[accessor["componentType"]]).newbyteorder("<")
+    components = TYPE_SIZES[accessor["type"]]
+    count = accessor["count"]
+    if "bufferView" not in accessor:
+        return np.zeros((count, components), dtype=dtype)
+
+    view = gltf["bufferViews"][accessor["bufferView"]]
+    if view.get("buffer", 0) != 0 or bin_chunk is None:
+        raise UnsupportedGlbError("only buffers embedded in the GLB binary chunk are supported")
+    offset = view.get("byteOffset", 0) + accessor.get("byteOffset", 0)
+    stride = view.get("byteStride", dtype.itemsize * components)
+    array = np.ndarray(
+        (count, components),
+        dtype=dtype,
+        buffer=bin_chunk,
+        offset=offset,
+        strides=(stride, dtype.itemsize),
+    )
+    if accessor.get("normalized"):
+        # signed: the most negative value maps below -1, glTF clamps it
+        array = np.maximum(array.astype(np.float32) / np.iinfo(dtype).max, -1.0)
+    return array
+
+
+def quaternion_to_matrix(q) -> np.ndarray:
+    x, y, z, w = q  # glTF order
+    return np.array(
+        [
+            [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+            [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+            [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+        ]
+    )
+
+
+def node_matrix(node: Dict) -> np.ndarray:
+    if "matrix" in node:
+        return np.array(node["matrix"], dtype=np.float64).reshape(4, 4).T  # column major
+    matrix = np.eye(4)
+    matrix[:3, :3] = quaternion_to_matrix(node.get("rotation", [0, 0, 0, 1])) * np.array(
+        node.get("scale", [1, 1, 1])
+    )
+    matrix[:3, 3] = node.get("translation", [0, 0, 0])
+    return matrix
+
+
+def iter_mesh_instances(gltf: Dict) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Yield (mesh index, world matrix) for every node of the default scene that has a mesh.
+    """
+    nodes = gltf.get("nodes", [])
+    if "scenes" in gltf:
+        roots = gltf["scenes"][gltf.get("scene", 0)].get("nodes", [])
+    else:
+        children = {c for node in nodes for c in node.get("children", [])}
+        roots = [k for k in range(len(nodes)) if k not in children]
+
+    stack = [(k, np.eye(4)) for k in roots]
+    while stack:
+        k, parent_matrix = stack.pop()
+        matrix = parent_matrix @ node_matrix(nodes[k])
+        if "mesh" in nodes[k]:
+            yield nodes[k]["mesh"], matrix
+        stack.extend((c, matrix) for c in nodes[k].get("children", []))
+
+
+def load_glb_geometry(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    All triangles of a GLB in blender world space, materials and images are never read.
+    Returns (V, 3) float32 vertices and (T, 3) int32 vertex indices.
+    """
+    gltf, bin_chunk = read_glb(path)
+    verts_list = []
+    tris_list = []
+    num_verts = 0
+    for mesh_idx, matrix in iter_mesh_instances(gltf):
+        for primitive in gltf["meshes"][mesh_idx]["primitives"]:
+            if "KHR_draco_mesh_compression" in primitive.get("extensions", {}):
+                raise UnsupportedGlbError(f"draco compressed meshes are not supported: {path}")
+            if primitive.get("mode", 4) != 4:
+                print("skipping non triangle primitive, mode: ", primitive.get("mode"))
+                continue
+            positions = get_accessor_array(gltf, bin_chunk, primitive["attributes"]["POSITION"])
+            if "indices" in primitive:
+                indices = get_accessor_array(gltf, bin_chunk, primitive["indices"]).ravel()
+            else:
+                indices = np.arange(len(positions))
+
+            world = Y_UP_TO_Z_UP @ matrix[:3, :3]
+            verts_list.append(positions @ world.T + Y_UP_TO_Z_UP @ matrix[:3, 3])
+            tris_list.append(indices.astype(np.int32).reshape(-1, 3) + num_verts)
+            num_verts += len(positions)
+
+    assert verts_list, f"no triangle mesh found: {path}"
+    verts = np.concatenate(verts_list).astype(np.float32)
+    tris = np.concatenate(tris_list)
+    return verts, tris
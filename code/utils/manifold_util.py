@@ -1,20 +1,60 @@
+import abc
+import atexit
 import hashlib
+import json
 import os
+import queue
+import random
+import shutil
 import subprocess
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+from . import cache_util as cutil
+
+
+class CommandError(subprocess.CalledProcessError):
+    # a failed command, its message includes the stderr
+    def __str__(self):
+        return f"{super().__str__()} {(self.stderr or '').strip()}"
+
+
+def retry_with_backoff(
+    fn: Callable,
+    retries: int = 3,
+    base_delay: float = 0.5,
+    max_delay: float = 30.0,
+    retry_on: Tuple[type, ...] = (subprocess.CalledProcessError, OSError),
+):
+    """
+    Call fn() until it does not raise, at most retries + 1 times. The k-th retry waits a
+    random time up to base_delay * 2**k (full jitter), so workers that failed together
+    do not retry together. Only failed commands and I/O errors are retried, anything
+    else is a bug and raised right away.
+    """
+    for k in range(retries + 1):
+        try:
+            return fn()
+        except retry_on as e:
+            if k == retries:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2**k))
+            print(f"{e}, retrying in {delay:.1f}s ({k + 1}/{retries})")
+            time.sleep(delay)
 
 
 def run_command(cmd: str, retries=0) -> None:
     print(f"Running command: {cmd}")
-    for k in range(retries + 1):
-        retc = os.system(cmd)
-        if retc == 0:
-            return
-        time.sleep(1)
-        if k == retries:
-            raise RuntimeError(
-                f'Command "{cmd}" failed with return code {retc} after {retries} retries.'
-            )
+
+    def run():
+        retc = subprocess.run(cmd, shell=True).returncode
+        if retc != 0:
+            raise CommandError(retc, cmd)
+
+    retry_with_backoff(run, retries)
 
 
 def subprocess_run_command(cmd):
@@ -24,6 +64,21 @@ def subprocess_run_command(cmd):
     assert result.returncode == 0, result.stderr
 
 
+def run_args(args: List[str], retries: int = 3) -> subprocess.CompletedProcess:
+    """
+    Run a command given as argument list (no shell, paths need no quoting), retried with
+    backoff, raises CommandError with its stderr if all attempts fail.
+    """
+
+    def run():
+        result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            raise CommandError(result.returncode, args, result.stdout, result.stderr)
+        return result
+
+    return retry_with_backoff(run, retries)
+
+
 def is_manifold_path(p: str) -> bool:
     return p.startswith("manifold://")
 
@@ -34,52 +89,407 @@ def get_manifold_path(p: str) -> str:
     return p
 
 
-def manifold_get_file(manifold_path: str, dest_file) -> None:
+MANIFOLD_CLI = ["manifold", "--prod-use-cython-client"]
+
+
+def manifold_get_file(manifold_path: str, dest_file, retries: int = 3) -> None:
     path = get_manifold_path(manifold_path)
-    cmd = f"manifold --prod-use-cython-client get {path} {dest_file} --overwrite"
-    subprocess_run_command(cmd)
+    run_args(MANIFOLD_CLI + ["get", path, dest_file, "--overwrite"], retries)
 
 
-def manifold_put_dir(local_dir: str, remote_dir) -> None:
+def manifold_put_dir(local_dir: str, remote_dir, retries: int = 3) -> None:
     remote_dir = get_manifold_path(remote_dir)
-    cmd = f"manifold --prod-use-cython-client putr {local_dir} {remote_dir} --overwrite"
-    subprocess_run_command(cmd)
+    run_args(MANIFOLD_CLI + ["putr", local_dir, remote_dir, "--overwrite"], retries)
+
+
+def manifold_put_file(local_file: str, manifold_path: str, retries: int = 3) -> None:
+    path = get_manifold_path(manifold_path)
+    run_args(MANIFOLD_CLI + ["put", local_file, path, "--overwrite"], retries)
 
 
-def manifold_mkdirs(remote_dir) -> None:
+def manifold_mkdirs(remote_dir, retries: int = 3) -> None:
     remote_dir = get_manifold_path(remote_dir)
-    cmd = f"manifold mkdirs {remote_dir}"
-    subprocess_run_command(cmd)
+    run_args(["manifold", "mkdirs", remote_dir], retries)
+
+
+def manifold_exists(manifold_path: str) -> bool:
+    path = get_manifold_path(manifold_path)
+    result = subprocess.run(
+        ["manifold", "ls", path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return result.returncode == 0
 
 
 def str_hash(s: str) -> str:
     return hashlib.md5(s.encode()).hexdigest()
 
 
-def download_if_on_manifold(path: str, tmp_dir: str = "./") -> str:
+class StorageBackend(abc.ABC):
+    """
+    Remote file store interface. get/put/exists/mkdirs move single files. get_many
+    and put_many take (source, destination) pairs and run them on a thread pool,
+    a backend that can batch the transfers overrides them.
+    Paths on the remote side are manifold://bucket/... paths.
+    """
+
+    max_workers = 8
+
+    @abc.abstractmethod
+    def get(self, remote_path: str, dest_file: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    def put(self, local_file: str, remote_path: str) -> None:
+        pass
+
+    @abc.abstractmethod
+    def exists(self, remote_path: str) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def mkdirs(self, remote_dir: str) -> None:
+        pass
+
+    def _map(self, fn: Callable, pairs: List[Tuple[str, str]]) -> None:
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            # list() re-raises the first failure
+            list(pool.map(lambda pair: fn(*pair), pairs))
+
+    def get_many(self, pairs: List[Tuple[str, str]]) -> None:
+        self._map(self.get, pairs)
+
+    def put_many(self, pairs: List[Tuple[str, str]]) -> None:
+        self._map(self.put, pairs)
+
+
+class ManifoldBackend(StorageBackend):
+    """
+    The manifold CLI. Every call is a process, so put_many stages the files (hard links)
+    in their remote layout and uploads them with a single putr.
+    """
+
+    def __init__(self, retries: int = 3, min_batch: int = 4):
+        self.retries = retries
+        self.min_batch = min_batch
+
+    def get(self, remote_path: str, dest_file: str) -> None:
+        manifold_get_file(remote_path, dest_file, self.retries)
+
+    def put(self, local_file: str, remote_path: str) -> None:
+        manifold_put_file(local_file, remote_path, self.retries)
+
+    def exists(self, remote_path: str) -> bool:
+        return manifold_exists(remote_path)
+
+    def mkdirs(self, remote_dir: str) -> None:
+        manifold_mkdirs(remote_dir, self.retries)
+
+    def put_many(self, pairs: List[Tuple[str, str]]) -> None:
+        if len(pairs) < self.min_batch:
+            super().put_many(pairs)
+            return
+        remote_paths = [get_manifold_path(remote_path) for _, remote_path in pairs]
+        remote_root = os.path.commonpath([os.path.dirname(p) for p in remote_paths])
+        with tempfile.TemporaryDirectory() as stage_dir:
+            for (local_file, _), remote_path in zip(pairs, remote_paths):
+                staged_file = os.path.join(stage_dir, os.path.relpath(remote_path, remote_root))
+                os.makedirs(os.path.dirname(staged_file), exist_ok=True)
+                try:
+                    os.link(local_file, staged_file)
+                except OSError:  # cross device
+                    shutil.copyfile(local_file, staged_file)
+            manifold_put_dir(stage_dir, remote_root, self.retries)
+
+
+class LocalDirBackend(StorageBackend):
+    """
+    Stand-in for manifold backed by a local directory, manifold://bucket/a/b is
+    <root>/bucket/a/b. Used to run the caching and upload code offline.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def local_path(self, remote_path: str) -> str:
+        return os.path.join(self.root, get_manifold_path(remote_path))
+
+    def get(self, remote_path: str, dest_file: str) -> None:
+        shutil.copyfile(self.local_path(remote_path), dest_file)
+
+    def put(self, local_file: str, remote_path: str) -> None:
+        dest_file = self.local_path(remote_path)
+        os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+        tmp_file = f"{dest_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(local_file, tmp_file)
+        os.replace(tmp_file, dest_file)
+
+    def exists(self, remote_path: str) -> bool:
+        return os.path.exists(self.local_path(remote_path))
+
+    def mkdirs(self, remote_dir: str) -> None:
+        os.makedirs(self.local_path(remote_dir), exist_ok=True)
+
+
+# one BlobCache per cache dir and process, its pins are held by that instance
+_blob_caches = {}
+_blob_caches_lock = threading.Lock()
+
+
+def get_blob_cache(cache_dir: str, max_bytes: int = None) -> cutil.BlobCache:
+    # max_bytes None keeps the budget of an existing cache
+    cache_dir = os.path.abspath(cache_dir)
+    with _blob_caches_lock:
+        if cache_dir not in _blob_caches:
+            _blob_caches[cache_dir] = cutil.BlobCache(cache_dir)
+        if max_bytes is not None:
+            _blob_caches[cache_dir].max_bytes = max_bytes
+        return _blob_caches[cache_dir]
+
+
+def download_if_on_manifold(
+    path: str, tmp_dir: str = "./", max_bytes: int = 20 << 30, backend=None, pin: bool = False
+) -> str:
+    """
+    Local copy of a manifold path, cached in tmp_dir (LRU under max_bytes, shared by
+    all processes using the same tmp_dir). Local paths are returned as is. With pin
+    the copy is not evicted before release_if_on_manifold(path, tmp_dir).
+    """
     if is_manifold_path(path):
-        local_path = os.path.join(tmp_dir, str_hash(path))
-        if not os.path.exists(local_path):
-            manifold_get_file(path, local_path)
-        return local_path
+        backend = backend or ManifoldBackend()
+        return get_blob_cache(tmp_dir, max_bytes).get(path, backend.get, pin=pin)
     else:
         return path
 
 
-class ManifoldUploader:
+def release_if_on_manifold(path: str, tmp_dir: str = "./") -> None:
+    if is_manifold_path(path):
+        get_blob_cache(tmp_dir).release(path)
+
+
+def fetch_many(
+    paths: List[str],
+    tmp_dir: str = "./",
+    max_bytes: int = 20 << 30,
+    backend=None,
+    max_workers: int = 8,
+) -> Dict[str, str]:
+    """
+    download_if_on_manifold for many paths at once on a bounded thread pool, returns
+    {path: local path}. Each download is a manifold child process, so the threads
+    only wait. Raises the first failure after all downloads finished.
+    The downloads are pinned, later ones cannot evict earlier ones. Call
+    release_many(paths, tmp_dir) once the local copies are no longer used.
+    """
+    paths = list(dict.fromkeys(paths))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            path: pool.submit(download_if_on_manifold, path, tmp_dir, max_bytes, backend, True)
+            for path in paths
+        }
+    failed = [path for path, future in futures.items() if future.exception() is not None]
+    if failed:
+        release_many([path for path in paths if path not in failed], tmp_dir)
+        futures[failed[0]].result()
+    local_paths = {path: future.result() for path, future in futures.items()}
+    missing = [path for path in local_paths.values() if not os.path.exists(path)]
+    assert not missing, f"downloaded files are missing: {missing}"
+    return local_paths
+
+
+def release_many(paths: List[str], tmp_dir: str = "./") -> None:
+    for path in dict.fromkeys(paths):
+        release_if_on_manifold(path, tmp_dir)
+
+
+class StreamingUploader:
     """
-    Map a manifold dir to a local directory and upload it when the object is destroyed
+    Upload the files of local_dir to remote_dir while they are being written. A watcher
+    thread polls the directory and queues every file that did not change for
+    settle_seconds, upload threads put it. Content hashes of the uploaded files are kept
+    in a manifest in local_dir, so unchanged files are never uploaded twice, also across
+    runs. close() uploads what is left and raises if any upload failed.
     """
 
-    def __init__(self, manifold_dir: str, tmp_dir: str = "./", verbose: bool = False):
+    MANIFEST = ".upload_manifest.json"
+
+    def __init__(
+        self,
+        local_dir: str,
+        remote_dir: str,
+        backend=None,
+        poll_seconds: float = 2.0,
+        settle_seconds: float = 2.0,
+        num_threads: int = 2,
+        batch_size: int = 64,
+        verbose: bool = False,
+    ):
+        self.local_dir = local_dir
+        self.remote_dir = remote_dir.rstrip("/")
+        self.backend = backend or ManifoldBackend()
+        self.poll_seconds = poll_seconds
+        self.settle_seconds = settle_seconds
+        self.batch_size = batch_size
         self._verbose = verbose
+        os.makedirs(local_dir, exist_ok=True)
+
+        self.manifest_file = os.path.join(local_dir, self.MANIFEST)
+        self.manifest = {}  # relative path -> {"md5", "size", "mtime"}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file) as f:
+                self.manifest = json.load(f)
+        self.errors = {}  # relative path -> error of its last failed upload
+        self._seen = {}  # relative path -> (size, mtime) at the previous scan
+        self._queued = set()
+        self._remote_dirs = set()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._closed = False
+
+        self._threads = [threading.Thread(target=self._watch, daemon=True)]
+        self._threads += [
+            threading.Thread(target=self._upload_worker, daemon=True) for _ in range(num_threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_seconds):
+            self.scan()
+
+    def scan(self, final: bool = False) -> None:
+        """
+        Queue the finished files that changed since their last upload. With final every
+        file counts as finished.
+        """
+        now = time.time()
+        for root, _, files in os.walk(self.local_dir):
+            for file in files:
+                if file == self.MANIFEST or file.endswith(".tmp"):
+                    continue
+                local_file = os.path.join(root, file)
+                rel_path = os.path.relpath(local_file, self.local_dir)
+                try:
+                    stat = os.stat(local_file)
+                except FileNotFoundError:
+                    continue
+                state = (stat.st_size, stat.st_mtime)
+                stable = self._seen.get(rel_path) == state
+                self._seen[rel_path] = state
+                if not final and (not stable or now - stat.st_mtime < self.settle_seconds):
+                    continue
+                with self._lock:
+                    entry = self.manifest.get(rel_path)
+                    if entry and (entry["size"], entry["mtime"]) == state:
+                        continue
+                    if rel_path in self._queued:
+                        continue
+                    self._queued.add(rel_path)
+                self._queue.put(rel_path)
+
+    def _upload_worker(self) -> None:
+        while True:
+            # take what is queued (up to batch_size) at once, put_many may batch it
+            batch = [self._queue.get()]
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            rel_paths = [rel_path for rel_path in batch if rel_path is not None]
+            try:
+                if rel_paths:
+                    self._upload(rel_paths)
+                with self._lock:
+                    # a file that failed before and was uploaded again is no error
+                    for rel_path in rel_paths:
+                        self.errors.pop(rel_path, None)
+            except Exception as e:
+                print(f"failed to upload {rel_paths}: {e}")
+                with self._lock:
+                    self.errors.update((rel_path, str(e)) for rel_path in rel_paths)
+            finally:
+                with self._lock:
+                    self._queued.difference_update(rel_paths)
+                for _ in batch:
+                    self._queue.task_done()
+            if batch[-1] is None:
+                return
+
+    def _upload(self, rel_paths: List[str]) -> None:
+        entries = {}
+        pairs = []
+        for rel_path in rel_paths:
+            local_file = os.path.join(self.local_dir, rel_path)
+            stat = os.stat(local_file)
+            md5 = cutil.file_hash(local_file)
+            entries[rel_path] = {"md5": md5, "size": stat.st_size, "mtime": stat.st_mtime}
+            with self._lock:
+                unchanged = self.manifest.get(rel_path, {}).get("md5") == md5
+            if not unchanged:
+                pairs.append((local_file, f"{self.remote_dir}/{rel_path}"))
+
+        for remote_dir in sorted({os.path.dirname(remote_path) for _, remote_path in pairs}):
+            if remote_dir not in self._remote_dirs:
+                self.backend.mkdirs(remote_dir)
+                self._remote_dirs.add(remote_dir)
+        if pairs:
+            if self._verbose:
+                print(f"Uploading {len(pairs)} files to {self.remote_dir}")
+            self.backend.put_many(pairs)
+        with self._lock:
+            self.manifest.update(entries)
+            self._save_manifest()
+
+    def _save_manifest(self) -> None:
+        with open(self.manifest_file + ".tmp", "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(self.manifest_file + ".tmp", self.manifest_file)
+
+    def flush(self) -> None:
+        # upload everything written so far and wait for it
+        self.scan(final=True)
+        self._queue.join()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._stop.set()
+        self._threads[0].join()
+        self.flush()
+        for _ in self._threads[1:]:
+            self._queue.put(None)
+        for thread in self._threads[1:]:
+            thread.join()
+        if self.errors:
+            raise RuntimeError(
+                f"{len(self.errors)} uploads to {self.remote_dir} failed: {self.errors}"
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ManifoldUploader(StreamingUploader):
+    """
+    Map a manifold dir to a local directory and upload what is written to it in the
+    background, the rest on close(). Use it as a context manager or call close(), an
+    uploader that is still open at interpreter exit is closed by atexit.
+    """
+
+    def __init__(
+        self, manifold_dir: str, tmp_dir: str = "./", verbose: bool = False, backend=None
+    ):
         self.manifold_dir = manifold_dir
         self._tmp_dir = tmp_dir
-        self.local_dir = os.path.join(tmp_dir, str_hash(manifold_dir))
-        if not os.path.exists(self.local_dir):
-            os.makedirs(self.local_dir)
-
-    def __del__(self):
-        if self._verbose:
-            print(f"Uploading to {self.manifold_dir}")
-        manifold_put_dir(self.local_dir, self.manifold_dir)
+        local_dir = os.path.join(tmp_dir, str_hash(manifold_dir))
+        super().__init__(local_dir, manifold_dir, backend=backend, verbose=verbose)
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        atexit.unregister(self.close)
+        super().close()
@@ -0,0 +1,232 @@
+import functools
+import inspect
+import json
+import os
+import re
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+import bpy
+
+_SAMPLE_RE = re.compile(r"Sample (\d+)/(\d+)")
+_DATABLOCK_TYPES = ["objects", "meshes", "materials", "images", "actions", "node_groups"]
+
+# the profiler of the running job, see start_profiling
+_active = None
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / (1 << 10)
+
+
+def datablock_counts() -> Dict[str, int]:
+    return {attr: len(getattr(bpy.data, attr)) for attr in _DATABLOCK_TYPES}
+
+
+def stats_phase(stats: str) -> str:
+    # the last field of the render stats is what the renderer is doing, e.g. "Building BVH"
+    phase = stats.split("|")[-1].strip()
+    if _SAMPLE_RE.search(phase) or phase.startswith("Sample"):
+        return "sampling"
+    return re.sub(r"[\d/.:]+", "", phase).strip() or "unknown"
+
+
+class RenderProfiler:
+    """
+    Record where the time of a render job goes. Spans (import, normalize, keyframing, ...)
+    come from span() or wrap_module(), per-frame records and the renderer phases (sync,
+    BVH build, sampling, compositing, ...) from the render_pre/render_stats/render_post/
+    render_write handlers. Records are appended to a JSONL file as they happen,
+    save_chrome_trace() exports them for chrome://tracing or Perfetto.
+    """
+
+    def __init__(self, jsonl_file: str, job: str = None):
+        self.jsonl_file = jsonl_file
+        self.job = job
+        self.records = []
+        self._t0 = time.perf_counter()
+        self._frame = None
+        self._phase = None
+        self._post_ts = None
+        self._wrapped = []
+        os.makedirs(os.path.dirname(os.path.abspath(jsonl_file)), exist_ok=True)
+        self._handlers = [
+            (bpy.app.handlers.render_pre, self._on_render_pre),
+            (bpy.app.handlers.render_stats, self._on_render_stats),
+            (bpy.app.handlers.render_post, self._on_render_post),
+            (bpy.app.handlers.render_write, self._on_render_write),
+        ]
+
+    def _now_us(self) -> float:
+        return (time.perf_counter() - self._t0) * 1e6
+
+    def _emit(self, record: Dict) -> None:
+        record = {"job": self.job, "pid": os.getpid(), "time": time.time(), **record}
+        self.records.append(record)
+        with open(self.jsonl_file, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    @contextmanager
+    def span(self, name: str, **args):
+        ts = self._now_us()
+        try:
+            yield
+        finally:
+            self._emit(
+                {
+                    "type": "span",
+                    "name": name,
+                    "ts": ts,
+                    "dur": self._now_us() - ts,
+                    "peak_rss_mb": peak_rss_mb(),
+                    "args": args,
+                }
+            )
+
+    def wrap_module(self, module) -> None:
+        """
+        Record a span for every call of a function defined in module, until unwrap().
+        """
+        for name, fn in list(vars(module).items()):
+            if not inspect.isfunction(fn) or fn.__module__ != module.__name__:
+                continue
+
+            def wrapper(*args, _fn=fn, _name=f"{module.__name__}.{name}", **kwargs):
+                with self.span(_name):
+                    return _fn(*args, **kwargs)
+
+            setattr(module, name, functools.wraps(fn)(wrapper))
+            self._wrapped.append((module, name, fn))
+
+    def unwrap(self) -> None:
+        for module, name, fn in self._wrapped:
+            setattr(module, name, fn)
+        self._wrapped = []
+
+    def _end_phase(self) -> None:
+        if self._phase is None:
+            return
+        name, ts = self._phase
+        self._emit(
+            {
+                "type": "phase",
+                "name": name,
+                "frame": self._frame["frame"] if self._frame else None,
+                "ts": ts,
+                "dur": self._now_us() - ts,
+            }
+        )
+        self._phase = None
+
+    def _on_render_pre(self, scene, *args):
+        self._frame = {"frame": scene.frame_current, "ts": self._now_us(), "samples": None}
+
+    def _on_render_stats(self, *args):
+        stats = next((a for a in args if isinstance(a, str)), "")
+        match = _SAMPLE_RE.search(stats)
+        if match and self._frame:
+            self._frame["samples"] = int(match.group(1))
+        phase = stats_phase(stats)
+        if self._phase is None or self._phase[0] != phase:
+            self._end_phase()
+            self._phase = (phase, self._now_us())
+
+    def _on_render_post(self, scene, *args):
+        self._end_phase()
+        if self._frame is None:
+            return
+        self._post_ts = self._now_us()
+        self._emit(
+            {
+                "type": "frame",
+                "name": f"frame {self._frame['frame']}",
+                "frame": self._frame["frame"],
+                "ts": self._frame["ts"],
+                "dur": self._post_ts - self._frame["ts"],
+                "samples": self._frame["samples"],
+                "peak_rss_mb": peak_rss_mb(),
+                "datablocks": datablock_counts(),
+            }
+        )
+
+    def _on_render_write(self, scene, *args):
+        if self._post_ts is None:
+            return
+        self._emit(
+            {
+                "type": "phase",
+                "name": "file write",
+                "frame": scene.frame_current,
+                "ts": self._post_ts,
+                "dur": self._now_us() - self._post_ts,
+            }
+        )
+        self._post_ts = None
+
+    def register(self) -> None:
+        for handlers, fn in self._handlers:
+            handlers.append(fn)
+
+    def unregister(self) -> None:
+        for handlers, fn in self._handlers:
+            if fn in handlers:
+                handlers.remove(fn)
+
+    def save_chrome_trace(self, trace_file: str) -> None:
+        # spans on thread 0, frames on 1, renderer phases on 2
+        tids = {"span": 0, "frame": 1, "phase": 2}
+        events = []
+        for r in self.records:
+            args = {k: v for k, v in r.items() if k not in ["type", "name", "ts", "dur", "pid"]}
+            events.append(
+                {
+                    "name": r["name"],
+                    "cat": r["type"],
+                    "ph": "X",
+                    "ts": r["ts"],
+                    "dur": r["dur"],
+                    "pid": r["pid"],
+                    "tid": tids[r["type"]],
+                    "args": args,
+                }
+            )
+        with open(trace_file, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def start_profiling(jsonl_file: str, job: str = None, modules: List = None) -> RenderProfiler:
+    global _active
+    stop_profiling()
+    _active = RenderProfiler(jsonl_file, job)
+    _active.register()
+    for module in modules or []:
+        _active.wrap_module(module)
+    return _active
+
+
+def stop_profiling(chrome_trace_file: str = None) -> None:
+    global _active
+    if _active is None:
+        return
+    _active.unregister()
+    _active.unwrap()
+    if chrome_trace_file:
+        _active.save_chrome_trace(chrome_trace_file)
+    _active = None
+
+
+@contextmanager
+def span(name: str, **args):
+    """
+    Span of the active profiler, does nothing when profiling is off.
+    """
+    if _active is None:
+        yield
+        return
+    with _active.span(name, **args):
+        yield
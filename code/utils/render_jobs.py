@@ -0,0 +1,281 @@
+import json
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+DONE_MARKER = "_done.json"
+MERGE_LOCK = "_merge.lock"
+# job keys holding input files, fetched ahead of time by AssetPrefetcher
+ASSET_KEYS = ["model_file", "plane_file", "bg_file", "camera_file"]
+
+
+def load_manifest(manifest_file: str) -> List[Dict]:
+    """
+    Load render jobs from a JSON list (.json) or one entry per line (.jsonl).
+    An entry is either a model/script path or a dict with at least "model_file"
+    (or "script" for the scripts/* renderers), the remaining keys override the
+    base config for that job.
+    """
+    with open(manifest_file) as f:
+        if manifest_file.endswith(".jsonl"):
+            entries = [json.loads(line) for line in f if line.strip()]
+        else:
+            entries = json.load(f)
+    assert isinstance(entries, list), f"manifest is not a list: {manifest_file}"
+
+    jobs = []
+    for entry in entries:
+        if isinstance(entry, str):
+            key = "script" if entry.endswith(".py") else "model_file"
+            job = {key: entry}
+        else:
+            job = dict(entry)
+        jobs.append(job)
+    assign_job_names(jobs)
+    return jobs
+
+
+def job_name(job: Dict) -> str:
+    if "name" in job:
+        return job["name"]
+    path = job["script"] if "script" in job else job["model_file"]
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def assign_job_names(jobs: List[Dict]) -> None:
+    # model files from different categories may share a file name, keep the output dirs apart
+    counts = {}
+    for job in jobs:
+        job["name"] = job_name(job)
+        counts[job["name"]] = counts.get(job["name"], 0) + 1
+    seen = {}
+    for job in jobs:
+        name = job["name"]
+        if counts[name] > 1:
+            seen[name] = seen.get(name, 0) + 1
+            job["name"] = f"{name}_{seen[name]}"
+
+
+def job_dir(job: Dict, save_dir: str) -> str:
+    return job.get("save_dir", os.path.join(save_dir, job["name"]))
+
+
+def is_job_done(job_dir: str) -> bool:
+    return os.path.exists(os.path.join(job_dir, DONE_MARKER))
+
+
+def mark_job_done(job_dir: str, info: Optional[Dict] = None) -> None:
+    # write then rename, a preempted worker must never leave a marker behind
+    os.makedirs(job_dir, exist_ok=True)
+    marker = os.path.join(job_dir, DONE_MARKER)
+    with open(marker + ".tmp", "w") as f:
+        json.dump(info or {}, f)
+    os.replace(marker + ".tmp", marker)
+
+
+def shard_jobs(jobs: List, num_shards: int) -> List[List]:
+    return [jobs[k::num_shards] for k in range(num_shards)]
+
+
+def partition_cpus(num_workers: int, cpus: Optional[List[int]] = None) -> List[List[int]]:
+    """
+    Split the available cpus into num_workers disjoint contiguous groups.
+    """
+    if cpus is None:
+        if hasattr(os, "sched_getaffinity"):
+            cpus = sorted(os.sched_getaffinity(0))
+        else:
+            cpus = list(range(os.cpu_count()))
+    assert num_workers <= len(cpus), f"{num_workers} workers for {len(cpus)} cpus"
+    size, extra = divmod(len(cpus), num_workers)
+    groups = []
+    start = 0
+    for k in range(num_workers):
+        end = start + size + (1 if k < extra else 0)
+        groups.append(cpus[start:end])
+        start = end
+    return groups
+
+
+def split_frame_range(frames: int, num_chunks: int) -> List[Tuple[int, int]]:
+    """
+    Split frames [0, frames) into at most num_chunks contiguous inclusive ranges.
+    """
+    num_chunks = max(1, min(num_chunks, frames))
+    size, extra = divmod(frames, num_chunks)
+    ranges = []
+    start = 0
+    for k in range(num_chunks):
+        end = start + size + (1 if k < extra else 0)
+        ranges.append((start, end - 1))
+        start = end
+    return ranges
+
+
+def split_job_frames(job: Dict, frames: int, num_chunks: int) -> List[Dict]:
+    chunk_jobs = []
+    for start, end in split_frame_range(frames, num_chunks):
+        chunk = dict(job)
+        chunk["name"] = f"{job['name']}_{start:04d}"
+        chunk["save_dir"] = os.path.join(job["save_dir"], "_chunks", f"{start:04d}-{end:04d}")
+        chunk["frame_start"] = start
+        chunk["frame_end"] = end
+        chunk_jobs.append(chunk)
+    return chunk_jobs
+
+
+def concat_videos(video_files: List[str], output_file: str) -> None:
+    # stream copy, the chunks share codec and resolution so nothing is re-encoded
+    list_file = output_file + ".txt"
+    with open(list_file, "w") as f:
+        for video_file in video_files:
+            f.write(f"file '{os.path.abspath(video_file)}'\n")
+    cmd = ["ffmpeg", "-y", "-f", "concat", "-safe", "0", "-i", list_file]
+    cmd += ["-c", "copy", output_file]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    assert result.returncode == 0, result.stderr
+    os.remove(list_file)
+
+
+def merge_frame_chunks(job: Dict, chunk_jobs: List[Dict], video: bool) -> None:
+    """
+    Merge the chunk outputs of a sharded turntable back into the job folder in
+    frame order. Frames are named by their global frame number, so PNG (and pass)
+    outputs are moved as is, video chunks are concatenated.
+    """
+    job_dir = job["save_dir"]
+    chunk_jobs = sorted(chunk_jobs, key=lambda chunk: chunk["frame_start"])
+    if video:
+        videos = [os.path.join(chunk["save_dir"], "video.mp4") for chunk in chunk_jobs]
+        concat_videos(videos, os.path.join(job_dir, "video.mp4"))
+    else:
+        for chunk in chunk_jobs:
+            for root, _, files in os.walk(chunk["save_dir"]):
+                rel_dir = os.path.relpath(root, chunk["save_dir"])
+                os.makedirs(os.path.join(job_dir, rel_dir), exist_ok=True)
+                for file in files:
+                    if file != DONE_MARKER:
+                        os.replace(os.path.join(root, file), os.path.join(job_dir, rel_dir, file))
+    shutil.rmtree(os.path.join(job_dir, "_chunks"))
+
+
+def try_merge_frame_chunks(
+    job: Dict, chunk_jobs: List[Dict], video: bool, stale_lock_seconds: float = 600
+) -> bool:
+    """
+    Merge once every chunk is done. Several nodes may share the output folder,
+    the merge lock makes sure only one of them merges.
+    """
+    if is_job_done(job["save_dir"]):
+        return True
+    if not all(is_job_done(chunk["save_dir"]) for chunk in chunk_jobs):
+        return False
+
+    lock = os.path.join(job["save_dir"], MERGE_LOCK)
+    if os.path.exists(lock) and time.time() - os.path.getmtime(lock) > stale_lock_seconds:
+        os.remove(lock)  # left behind by a merge that crashed
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    os.close(fd)
+    try:
+        merge_frame_chunks(job, chunk_jobs, video)
+        mark_job_done(job["save_dir"], {"chunks": len(chunk_jobs)})
+    finally:
+        os.remove(lock)
+    return True
+
+
+def contiguous_ranges(frames: List[int]) -> List[Tuple[int, int]]:
+    """
+    Group sorted frame numbers into inclusive (start, end) runs, e.g. [1, 2, 3, 7] -> [(1, 3), (7, 7)].
+    """
+    ranges = []
+    for frame in frames:
+        if ranges and frame == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], frame)
+        else:
+            ranges.append((frame, frame))
+    return ranges
+
+
+class AssetPrefetcher:
+    """
+    Download the input files of the next lookahead jobs in background threads while
+    the current one renders. fetch(path) -> local path is called once per path, e.g.
+    manifold_util.download_if_on_manifold, local files are passed through unchanged.
+    If fetch pins its downloads in a cache, release(path) unpins them: finish(index)
+    releases the files of a finished job no later job uses, close() the rest.
+    """
+
+    def __init__(
+        self,
+        jobs: List[Dict],
+        fetch: Callable[[str], str],
+        lookahead: int = 2,
+        max_workers: int = 4,
+        release: Optional[Callable[[str], None]] = None,
+    ):
+        self.jobs = jobs
+        self.fetch = fetch
+        self.release = release
+        self.lookahead = lookahead
+        self.futures: Dict[str, Future] = {}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _submit(self, job: Dict, keys: List[str] = ASSET_KEYS) -> None:
+        for key in keys:
+            path = job.get(key)
+            if path and path not in self.futures:
+                self.futures[path] = self._pool.submit(self.fetch, path)
+
+    def prefetch(self, index: int) -> None:
+        """
+        Start fetching jobs[index] and the lookahead jobs after it.
+        """
+        for job in self.jobs[index : index + self.lookahead + 1]:
+            self._submit(job)
+
+    def resolve(self, job: Dict, keys: List[str] = ASSET_KEYS) -> Dict:
+        """
+        Copy of job with the asset paths of keys replaced by local paths, waits for their
+        download. The other keys are left as they are, not even fetched.
+        """
+        self._submit(job, keys)
+        resolved = dict(job)
+        for key in keys:
+            if job.get(key):
+                resolved[key] = self.futures[job[key]].result()
+                assert os.path.exists(resolved[key]), f"fetched file is missing: {resolved[key]}"
+        return resolved
+
+    def _release(self, path: str) -> None:
+        future = self.futures.pop(path)
+        if self.release and not future.cancelled() and future.exception() is None:
+            self.release(path)
+
+    def finish(self, index: int) -> None:
+        """
+        jobs[index] is done, release its files unless a later job uses them as well.
+        """
+        needed = {job.get(key) for job in self.jobs[index + 1 :] for key in ASSET_KEYS}
+        for key in ASSET_KEYS:
+            path = self.jobs[index].get(key)
+            if path and path not in needed and path in self.futures:
+                self._release(path)
+
+    def close(self) -> None:
+        # wait for the running downloads, their pins are released as well
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        for path in list(self.futures):
+            self._release(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,8 +1,13 @@
 # (c) Meta Platforms, Inc. and affiliates. Confidential and proprietary.
-from typing import List
+from typing import List, Tuple, Union
 
 import numpy as np
 
+# an int seed, a np.random.Generator or None for fresh entropy
+Seed = Union[int, np.random.Generator, None]
+
+GOLDEN_ANGLE = np.pi * (3 - np.sqrt(5))
+
 
 def generate_spiral_trajectory(
     center: List[float],
@@ -11,39 +16,254 @@ def generate_spiral_trajectory(
     num_loops: int = 1,
     extra=False,
     random=False,
-) -> List:
-
+    seed: Seed = None,
+) -> np.ndarray:
+    """
+    (num_points, 3) points on a spiral from the top to the bottom of the sphere, with
+    extra 8 more points at 30 and 0 degrees elevation.
+    """
     phi = np.arccos((1 - np.linspace(0, 1, num_points)) * 2 - 1)  # polar angles
     theta = np.linspace(0, 2.0 * np.pi * num_loops, num_points)  # azimuthal angles
     if random:
-        theta += np.random.rand() * np.pi * 2
-    # Convert spherical coordinates to Cartesian coordinates
-    x = center[0] + radius * np.sin(phi) * np.cos(theta)
-    y = center[1] + radius * np.sin(phi) * np.sin(theta)
-    z = center[2] + radius * np.cos(phi)
-    points = list(zip(x, y, z))
-    extra_points = []
+        # without a seed the global numpy state, np.random.seed keeps working
+        rng = np.random if seed is None else np.random.default_rng(seed)
+        theta += rng.random() * np.pi * 2
     if extra:
-        for phi in [np.pi / 3, np.pi / 2]:
-            for theta in [0, np.pi / 2, np.pi, np.pi * 3 / 2]:
-                x = center[0] + radius * np.sin(phi) * np.cos(theta)
-                y = center[1] + radius * np.sin(phi) * np.sin(theta)
-                z = center[2] + radius * np.cos(phi)
-                extra_points.append([x, y, z])
-    return points + extra_points
+        extra_phi, extra_theta = np.meshgrid([np.pi / 3, np.pi / 2], np.arange(4) * np.pi / 2)
+        phi = np.concatenate([phi, extra_phi.T.ravel()])
+        theta = np.concatenate([theta, extra_theta.T.ravel()])
+    # Convert spherical coordinates to Cartesian coordinates
+    directions = np.stack(
+        [np.sin(phi) * np.cos(theta), np.sin(phi) * np.sin(theta), np.cos(phi)], axis=1
+    )
+    return np.asarray(center, dtype=np.float64) + radius * directions
+
+
+def uniform_directions(num_points: int, z_min: float = -1.0, seed: Seed = None) -> np.ndarray:
+    """
+    Uniform random unit vectors with z >= z_min (-1: sphere, 0: upper hemisphere).
+    On a sphere z is uniform in area (Archimedes), so the band is sampled exactly.
+    """
+    rng = np.random.default_rng(seed)
+    z = rng.uniform(z_min, 1.0, num_points)
+    theta = rng.uniform(0, 2 * np.pi, num_points)
+    return z_theta_to_directions(z, theta)
+
+
+def fibonacci_directions(num_points: int, z_min: float = -1.0, seed: Seed = None) -> np.ndarray:
+    """
+    Fibonacci lattice, the most even deterministic spread of any number of points.
+    A seed randomly rotates the lattice around z.
+    """
+    offset = 0.0 if seed is None else np.random.default_rng(seed).uniform(0, 2 * np.pi)
+    k = np.arange(num_points)
+    z = 1.0 - (k + 0.5) / num_points * (1.0 - z_min)
+    return z_theta_to_directions(z, k * GOLDEN_ANGLE + offset)
+
+
+def stratified_directions(num_points: int, z_min: float = -1.0, seed: Seed = None) -> np.ndarray:
+    """
+    Jittered Latin hypercube in (z, azimuth): every one of num_points equal area bands
+    and every azimuth sector holds exactly one point.
+    """
+    rng = np.random.default_rng(seed)
+    z_strata = rng.permutation(num_points)
+    theta_strata = rng.permutation(num_points)
+    z = 1.0 - (z_strata + rng.random(num_points)) / num_points * (1.0 - z_min)
+    theta = (theta_strata + rng.random(num_points)) / num_points * 2 * np.pi
+    return z_theta_to_directions(z, theta)
+
+
+def _cell_keys(cells: np.ndarray, size: int) -> np.ndarray:
+    cells = cells + size // 2
+    return (cells[..., 0] * size + cells[..., 1]) * size + cells[..., 2]
+
+
+def _min_conflict_ids(
+    queries: np.ndarray,
+    query_cells: np.ndarray,
+    query_ids: np.ndarray,
+    ref_keys: np.ndarray,
+    ref_points: np.ndarray,
+    ref_ids: np.ndarray,
+    min_distance: float,
+    grid_size: int,
+    reach: int,
+) -> np.ndarray:
+    """
+    For each query the smallest id of the other ref points closer than min_distance,
+    int64 max if there is none. Refs are sorted by cell key, at most one per cell.
+    """
+    result = np.full(len(queries), np.iinfo(np.int64).max)
+    if len(ref_keys) == 0:
+        return result
+    offsets = np.arange(-reach, reach + 1)
+    for ox, oy in np.stack(np.meshgrid(offsets, offsets), axis=-1).reshape(-1, 2):
+        # the cells along z are consecutive keys, one search per row of cells
+        first_keys = _cell_keys(query_cells + [ox, oy, -reach], grid_size)
+        first_idx = np.searchsorted(ref_keys, first_keys)
+        for k in range(2 * reach + 1):
+            idx = np.minimum(first_idx + k, len(ref_keys) - 1)
+            close = (
+                (ref_keys[idx] >= first_keys)
+                & (ref_keys[idx] <= first_keys + 2 * reach)
+                & (ref_ids[idx] != query_ids)
+                & (np.einsum("ij,ij->i", *[ref_points[idx] - queries] * 2) < min_distance**2)
+            )
+            result = np.where(close, np.minimum(result, ref_ids[idx]), result)
+    return result
+
+
+def poisson_disk_directions(
+    num_points: int,
+    z_min: float = -1.0,
+    seed: Seed = None,
+    min_angle: float = None,
+    max_rounds: int = 64,
+) -> np.ndarray:
+    """
+    Blue noise: random unit vectors at least min_angle (radians) apart, by default a
+    spacing random dart throwing reaches num_points with in a few rounds. Darts are
+    thrown in vectorized batches: a grid of cells too small to hold two points indexes
+    the accepted points, a candidate is kept if it conflicts neither with them nor with
+    an earlier candidate of its batch. Raises ValueError if num_points do not fit
+    within max_rounds, i.e. min_angle is too large.
+    """
+    rng = np.random.default_rng(seed)
+    area = 2 * np.pi * (1.0 - z_min)
+    if min_angle is None:
+        # disks of diameter min_distance covering 35% of the area, well below the ~55%
+        # where random sequential packing saturates and acceptance stalls
+        min_distance = 2 * np.sqrt(0.35 * area / np.pi / num_points)
+    else:
+        min_distance = 2 * np.sin(min_angle / 2)  # chord length
+    cell = min_distance / np.sqrt(3)  # the cell diagonal is min_distance
+    reach = int(np.ceil(min_distance / cell))
+    grid_size = 2 * (int(np.ceil(1 / cell)) + reach) + 1
+
+    none = np.iinfo(np.int64).max
+    keys = np.empty(0, dtype=np.int64)
+    points = np.empty((0, 3))
+    order = np.empty(0, dtype=np.int64)  # acceptance order of the key sorted points
+    for _ in range(max_rounds):
+        if len(points) >= num_points:
+            break
+        candidates = uniform_directions(max(2 * (num_points - len(points)), 1024), z_min, rng)
+        cells = np.floor(candidates / cell).astype(np.int64)
+        candidate_keys = _cell_keys(cells, grid_size)
+
+        # one candidate per cell, the earliest, and none next to an accepted point
+        _, first_idx = np.unique(candidate_keys, return_index=True)
+        first_idx = np.sort(first_idx)
+        candidates, cells = candidates[first_idx], cells[first_idx]
+        candidate_keys = candidate_keys[first_idx]
+        free = (
+            _min_conflict_ids(
+                candidates, cells, np.full(len(cells), -1), keys, points, order,
+                min_distance, grid_size, reach,
+            )
+            == none
+        )
+        candidates, cells, candidate_keys = candidates[free], cells[free], candidate_keys[free]
+
+        # within the batch a candidate is dropped if it is close to an earlier one
+        ids = np.arange(len(candidates))
+        sort = np.argsort(candidate_keys)
+        earlier = _min_conflict_ids(
+            candidates, cells, ids, candidate_keys[sort], candidates[sort], ids[sort],
+            min_distance, grid_size, reach,
+        )
+        accepted = earlier > ids
+
+        keys = np.concatenate([keys, candidate_keys[accepted]])
+        points = np.concatenate([points, candidates[accepted]])
+        order = np.concatenate([order, len(order) + np.arange(accepted.sum())])
+        sort = np.argsort(keys)
+        keys, points, order = keys[sort], points[sort], order[sort]
+
+    if len(points) < num_points:
+        raise ValueError(
+            f"only {len(points)} of {num_points} points fit {min_distance:.4g} apart,"
+            " lower min_angle or raise max_rounds"
+        )
+    # in acceptance order, the first n points of a larger set are spread evenly too
+    return points[np.argsort(order)][:num_points]
+
+
+def z_theta_to_directions(z: np.ndarray, theta: np.ndarray) -> np.ndarray:
+    r = np.sqrt(np.clip(1.0 - z * z, 0.0, None))
+    return np.stack([r * np.cos(theta), r * np.sin(theta), z], axis=1)
+
+
+def rotate_z_to(directions: np.ndarray, up) -> np.ndarray:
+    """
+    Rotate directions sampled around +Z so that +Z maps to up (Rodrigues).
+    """
+    up = np.asarray(up, dtype=np.float64)
+    up = up / np.linalg.norm(up)
+    axis = np.cross([0.0, 0.0, 1.0], up)
+    s, c = np.linalg.norm(axis), up[2]
+    if s < 1e-12:
+        return directions if c > 0 else directions * [1.0, -1.0, -1.0]
+    k = axis / s
+    K = np.array([[0, -k[2], k[1]], [k[2], 0, -k[0]], [-k[1], k[0], 0]])
+    R = np.eye(3) + s * K + (1 - c) * K @ K
+    return directions @ R.T
+
+
+DIRECTION_SAMPLERS = {
+    "uniform": uniform_directions,
+    "fibonacci": fibonacci_directions,
+    "stratified": stratified_directions,
+    "poisson_disk": poisson_disk_directions,
+}
+
+
+def generate_sphere_trajectory(
+    center: List[float],
+    radius: Union[float, Tuple[float, float]],
+    num_points: int,
+    method: str = "fibonacci",
+    seed: Seed = None,
+    up=(0.0, 0.0, 1.0),
+    min_elevation: float = None,
+) -> np.ndarray:
+    """
+    (num_points, 3) viewpoints on the sphere around center, sampled with one of
+    DIRECTION_SAMPLERS. radius may be a (min, max) range, sampled uniformly. With
+    min_elevation (radians above the plane normal to up) only the cap above it is used.
+    """
+    assert method in DIRECTION_SAMPLERS, f"unknown sampler {method}"
+    rng = np.random.default_rng(seed)
+    z_min = -1.0 if min_elevation is None else np.sin(min_elevation)
+    directions = rotate_z_to(DIRECTION_SAMPLERS[method](num_points, z_min, rng), up)
+    if np.ndim(radius) == 0:
+        radii = np.full((len(directions), 1), float(radius))
+    else:
+        radii = rng.uniform(radius[0], radius[1], (len(directions), 1))
+    return np.asarray(center, dtype=np.float64) + radii * directions
+
+
+def generate_hemisphere_trajectory(
+    center: List[float],
+    radius: Union[float, Tuple[float, float]],
+    num_points: int,
+    method: str = "fibonacci",
+    seed: Seed = None,
+    up=(0.0, 0.0, 1.0),
+    min_elevation: float = 0.0,
+) -> np.ndarray:
+    # viewpoints above the ground plane only, e.g. for a model standing on the plane
+    return generate_sphere_trajectory(center, radius, num_points, method, seed, up, min_elevation)
 
 
 # This is an common random sampling method and is used by zero123, prepared for the future use.
 def generate_uniform_sampled_trajectory(
-    center: List[float], radius_min: float, radius_max: float, num_points: int
-):
-    points = []
-    for _ in range(num_points):
-        vec = np.random.uniform(-1, 1, 3)
-        radius = np.random.uniform(radius_min, radius_max, 1)
-        vec = vec / np.linalg.norm(vec, axis=0) * radius[0]
-        points.append(vec)
-    return points
+    center: List[float], radius_min: float, radius_max: float, num_points: int, seed: Seed = None
+) -> np.ndarray:
+    return generate_sphere_trajectory(
+        center, (radius_min, radius_max), num_points, method="uniform", seed=seed
+    )
 
 
 available_trajectory_types = [
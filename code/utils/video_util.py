@@ -0,0 +1,60 @@
+import subprocess
+import tempfile
+
+import numpy as np
+
+
+class FFmpegPipeWriter:
+    """
+    Encode frames pushed one at a time through a persistent ffmpeg process,
+    frames are (H, W, 3) uint8 RGB arrays, row 0 at the top
+    """
+
+    def __init__(
+        self,
+        output_file: str,
+        width: int,
+        height: int,
+        fps: int = 24,
+        codec: str = "libx264",
+        crf: int = 18,
+    ):
+        self.output_file = output_file
+        self.width = width
+        self.height = height
+        cmd = ["ffmpeg", "-y", "-loglevel", "error"]
+        cmd += ["-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}"]
+        cmd += ["-r", str(fps), "-i", "-"]
+        cmd += ["-c:v", codec, "-crf", str(crf), "-pix_fmt", "yuv420p", output_file]
+        # a file, not a pipe: nobody reads a pipe while frames are written, once it is
+        # full ffmpeg blocks on its stderr and the next write blocks forever
+        self._stderr = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=self._stderr)
+
+    def write(self, frame: np.ndarray) -> None:
+        assert frame.shape == (self.height, self.width, 3), f"bad frame shape {frame.shape}"
+        assert frame.dtype == np.uint8
+        try:
+            self._proc.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            self.close()  # ffmpeg exited, raises with its error output
+            raise
+
+    def close(self) -> None:
+        if self._proc.stdin.closed:
+            return
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._proc.wait()
+        self._stderr.seek(0)
+        stderr = self._stderr.read().decode(errors="replace")
+        self._stderr.close()
+        assert self._proc.returncode == 0, f"ffmpeg failed for {self.output_file}: {stderr}"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -44,7 +44,7 @@ def load_iris():
         X = decomposition.PCA(n_components=3).fit_transform(X)
     except ImportError:
         # Load Iris dataset manually
-        path = os.path.join('data', 'iris', 'iris.data')
+        path = os.path.join(os.path.dirname(__file__), 'data', 'iris', 'iris.data')
         iris_data = np.genfromtxt(path, dtype='str', delimiter=',')
         X = iris_data[:, :4].astype(dtype=float)
         y = np.ndarray((X.shape[0],), dtype=int)
@@ -166,17 +166,10 @@ if __name__ == '__main__':
     # Animate rotation of target by keyframe animation
     target.rotation_mode = 'AXIS_ANGLE'
     target.rotation_axis_angle = (0, 0, 0, 1)
-    target.keyframe_insert(data_path='rotation_axis_angle', index=-1,
-        frame=bpy.context.scene.frame_start)
-    target.rotation_axis_angle = (2*pi, 0, 0, 1)
     # Set last frame to one frame further to have an animation loop
-    target.keyframe_insert(data_path='rotation_axis_angle', index=-1,
-        frame=bpy.context.scene.frame_end + 1)
-
-    # Change each created keyframe point to linear interpolation
-    for fcurve in target.animation_data.action.fcurves:
-        for keyframe in fcurve.keyframe_points:
-            keyframe.interpolation = 'LINEAR'
+    utils.set_keyframes(target, 'rotation_axis_angle', [
+        (bpy.context.scene.frame_start, (0, 0, 0, 1)),
+        (bpy.context.scene.frame_end + 1, (2*pi, 0, 0, 1))], interpolation='LINEAR')
 
     X, y, labels = load_iris()
     create_scatter(X, y)
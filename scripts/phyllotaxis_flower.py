@@ -108,8 +108,7 @@ class PhyllotaxisFlower():
 
 if __name__ == '__main__':
     # Remove all elements
-    bpy.ops.object.select_all(action="SELECT")
-    bpy.ops.object.delete(use_global=False)
+    utils.remove_all()
 
     # Creata phyllotaxis flower
     flower = PhyllotaxisFlower(bpy.context.scene)
@@ -28,13 +28,14 @@ if __name__ == '__main__':
 
     # Animate empty with keyframe animation
     # keyframe approach adapted from: http://blenderscripting.blogspot.co.at/2011/05/inspired-by-post-on-ba-it-just-so.html
+    samples = []
     for frame in range(1, num_frames):
         t = frame / num_frames
         x = 0.7*cos(2*pi*t) + 1
         y = 0.7*sin(2*pi*t)
         z = 0.4*sin(2*pi*t)
-        empty.location = (x, y, z)
-        empty.keyframe_insert(data_path="location", index=-1, frame=frame)
+        samples.append((frame, (x, y, z)))
+    utils.set_keyframes(empty, "location", samples)
 
     # Change each created keyframe point to linear interpolation
     #for fcurve in empty.animation_data.action.fcurves:
@@ -8,11 +8,10 @@ import os
 
 def remove_object(obj):
     if obj.type == 'MESH':
-        if obj.data.name in bpy.data.meshes:
-            bpy.data.meshes.remove(obj.data)
-        if obj.name in bpy.context.scene.objects:
-            bpy.context.scene.objects.unlink(obj)
-        bpy.data.objects.remove(obj)
+        mesh = obj.data
+        bpy.data.objects.remove(obj, do_unlink=True)
+        if mesh.users == 0:
+            bpy.data.meshes.remove(mesh)
     else:
         raise NotImplementedError('Other types not implemented yet besides \'MESH\'')
 
@@ -109,18 +108,52 @@ def rainbow_lights(r=5, n=100, freq=2, energy=0.1):
         obj.data.energy = energy
 
 
-def remove_all(type=None):
+def set_keyframes(obj, data_path, samples, interpolation='BEZIER'):
+    # Bulk version of keyframe_insert, samples is a list of (frame, value) with value
+    # a tuple of all components of data_path. Every fcurve is filled with one foreach_set.
+    if obj.animation_data is None:
+        obj.animation_data_create()
+    if obj.animation_data.action is None:
+        obj.animation_data.action = bpy.data.actions.new(obj.name + 'Action')
+    fcurves = obj.animation_data.action.fcurves
+    interpolation = bpy.types.Keyframe.bl_rna.properties['interpolation'] \
+        .enum_items[interpolation].value
+
+    for index in range(len(samples[0][1])):
+        fcurve = fcurves.find(data_path, index=index)
+        if fcurve:
+            fcurves.remove(fcurve)
+        fcurve = fcurves.new(data_path, index=index)
+        fcurve.keyframe_points.add(len(samples))
+        co = [c for frame, value in samples for c in (frame, value[index])]
+        fcurve.keyframe_points.foreach_set('co', co)
+        fcurve.keyframe_points.foreach_set('interpolation', [interpolation] * len(samples))
+        fcurve.update()
+
+
+def purge_orphans():
+    # Remove data without users recursively (meshes, then their materials, images, ...)
+    if hasattr(bpy.data, 'orphans_purge'):
+        bpy.data.orphans_purge(do_local_ids=True, do_linked_ids=True, do_recursive=True)
+        return
+    while True:
+        orphans = [d for attr in ['meshes', 'curves', 'metaballs', 'materials', 'textures',
+                                  'images', 'actions', 'cameras', 'lights', 'node_groups']
+                   for d in getattr(bpy.data, attr) if d.users == 0 and not d.use_fake_user]
+        if not orphans:
+            break
+        bpy.data.batch_remove(orphans)
+
+
+def remove_all(type=None, keep=()):
     # Possible type:
     # "MESH", "CURVE", "SURFACE", "META", "FONT", "ARMATURE",
     # "LATTICE", "EMPTY", "CAMERA", "LIGHT"
-    if type:
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.ops.object.select_by_type(type=type)
-        bpy.ops.object.delete()
-    else:
-        # Remove all elements in scene
-        bpy.ops.object.select_all(action="SELECT")
-        bpy.ops.object.delete(use_global=False)
+    # Objects in keep stay, the data of the removed objects is purged as well
+    objects = [obj for obj in bpy.context.scene.objects
+               if (type is None or obj.type == type) and obj not in keep]
+    bpy.data.batch_remove(objects)
+    purge_orphans()
 
 
 def create_material(base_color=(1, 1, 1, 1), metalic=0.0, roughness=0.5):
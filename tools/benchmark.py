@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import runpy
+import subprocess
+import sys
+import tempfile
+import time
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENES = [
+    "voronoi_sphere",
+    "voronoi_landscape",
+    "phyllotaxis_flower",
+    "tetrahedron_fractal",
+    "metaballs",
+    "parametric_torus",
+    "fisher_iris_visualization",
+]
+SHOWREEL = "showreel"
+
+# small but complete reference showreel job, the plane is the only bundled glb
+SHOWREEL_CONFIG = {
+    "plane_file": os.path.join(repo_path, "data", "glbs", "plane_round.glb"),
+    "model_file": os.path.join(repo_path, "data", "glbs", "plane_round.glb"),
+    "set_plane_material": True,
+    "radius": 5,
+    "angle": 5,
+    "resolution": 256,
+    "video": False,
+    "samples": 16,
+    "frames": 8,
+    "bg_lighting": False,
+}
+
+
+def run_scene_in_blender(script: str, result_file: str, seed: int, script_args=None) -> None:
+    """
+    Runs inside blender: execute a scene script as __main__ and time the scene construction
+    (until the first render starts) separately from the rendering.
+    """
+    import random
+
+    import bpy
+    import numpy as np
+
+    random.seed(seed)
+    np.random.seed(seed)
+
+    timings = {}
+    t0 = time.perf_counter()
+
+    def on_render_init(scene, *args):
+        if "construct_s" not in timings:
+            timings["construct_s"] = time.perf_counter() - t0
+            timings["_render_start"] = time.perf_counter()
+
+    def on_render_complete(scene, *args):
+        timings["render_s"] = time.perf_counter() - timings["_render_start"]
+
+    bpy.app.handlers.render_init.append(on_render_init)
+    bpy.app.handlers.render_complete.append(on_render_complete)
+
+    # the scripts import utils from their own folder
+    sys.path.insert(0, os.path.dirname(script))
+    sys.argv = [script] + (["--"] + script_args if script_args else [])
+    runpy.run_path(script, run_name="__main__")
+
+    timings["total_s"] = time.perf_counter() - t0
+    timings.pop("_render_start", None)
+    timings["blender_version"] = bpy.app.version_string
+    timings["seed"] = seed
+    with open(result_file, "w") as f:
+        json.dump(timings, f)
+
+
+def run_scene(scene: str, args) -> dict:
+    with tempfile.TemporaryDirectory() as work_dir:
+        result_file = os.path.join(work_dir, "result.json")
+        inner_args = ["--run", scene, "--result", result_file, "--seed", str(args.seed)]
+        cmd = [args.blender, "-b", "--factory-startup", "--python-exit-code", "1"]
+        cmd += ["-P", os.path.abspath(__file__), "--"] + inner_args
+        start = time.perf_counter()
+        proc = subprocess.run(
+            cmd, cwd=work_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+        )
+        wall_s = time.perf_counter() - start
+        if proc.returncode != 0 or not os.path.exists(result_file):
+            print(proc.stdout[-2000:])
+            return {"error": f"exit code {proc.returncode}"}
+        with open(result_file) as f:
+            result = json.load(f)
+    # process wall time includes blender startup
+    result["process_s"] = wall_s
+    return result
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    print(f"{'scene':<28}{'metric':<14}{'baseline':>10}{'current':>10}{'ratio':>8}")
+    for scene, result in results.items():
+        for metric in ["construct_s", "render_s", "total_s"]:
+            if metric not in result or metric not in baseline.get(scene, {}):
+                continue
+            base, cur = baseline[scene][metric], result[metric]
+            ratio = cur / base if base > 0 else float("inf")
+            flag = " !" if ratio > 1 + tolerance else ""
+            print(f"{scene:<28}{metric:<14}{base:>10.3f}{cur:>10.3f}{ratio:>8.2f}{flag}")
+            if flag:
+                regressions.append((scene, metric, ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    if "--run" in sys.argv:
+        # inner mode, started by run_scene inside blender
+        argv = sys.argv[sys.argv.index("--") + 1 :]
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--run", type=str, required=True)
+        parser.add_argument("--result", type=str, required=True)
+        parser.add_argument("--seed", type=int, default=0)
+        inner = parser.parse_args(argv)
+        if inner.run == SHOWREEL:
+            config_file = os.path.join(os.getcwd(), "showreel.json")
+            with open(config_file, "w") as f:
+                json.dump(SHOWREEL_CONFIG, f)
+            run_scene_in_blender(
+                os.path.join(repo_path, "code", "showreel_render.py"),
+                inner.result,
+                inner.seed,
+                ["--config", config_file, "--save_dir", os.path.join(os.getcwd(), "showreel")],
+            )
+        else:
+            run_scene_in_blender(
+                os.path.join(repo_path, "scripts", inner.run + ".py"), inner.result, inner.seed
+            )
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark scene construction and rendering of the bundled scenes",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--blender", type=str, default="blender", help="Blender binary")
+    parser.add_argument(
+        "--scenes",
+        type=str,
+        default=",".join(SCENES + [SHOWREEL]),
+        help="Comma separated scenes to run",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of random and numpy")
+    parser.add_argument("--output", type=str, default="bench_output.json", help="Results")
+    parser.add_argument("--baseline", type=str, default=None, help="Baseline json to compare to")
+    parser.add_argument(
+        "--update_baseline", action="store_true", help="Write the results to --baseline"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="Allowed slowdown before flagging"
+    )
+    args = parser.parse_args()
+
+    results = {}
+    for scene in args.scenes.split(","):
+        print(f"running {scene}")
+        results[scene] = run_scene(scene, args)
+        print(f"  {results[scene]}")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    failed = [scene for scene, result in results.items() if "error" in result]
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions above {args.tolerance:.0%}")
+            sys.exit(1)
+    if failed:
+        print(f"failed scenes: {failed}")
+        sys.exit(1)
+
+
+# python tools/benchmark.py --baseline=bench_baseline.json --update_baseline
+# python tools/benchmark.py --baseline=bench_baseline.json
@@ -0,0 +1,178 @@
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(repo_path, "code"))
+
+import utils.manifold_util as mfd
+import utils.render_jobs as rjobs
+
+SHOWREEL_SCRIPT = os.path.join(repo_path, "code", "showreel_render.py")
+
+
+def blender_command(
+    blender: str, threads: int, script: str, script_args=None, use_system_env=False
+):
+    # "-t" sets the Cycles thread count, "--python-exit-code" makes a python error fail the process
+    cmd = [blender, "-b", "-t", str(threads), "--python-exit-code", "1"]
+    if use_system_env:
+        # needed for PYTHONPATH, the scripts import utils from their own folder
+        cmd += ["--python-use-system-env"]
+    cmd += ["-P", script]
+    if script_args:
+        cmd += ["--"] + script_args
+    return cmd
+
+
+def run_blender(cmd, cpus, log_file: str, cwd=None, env=None) -> int:
+    def set_affinity():
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+
+    with open(log_file, "a") as log:
+        log.write("$ " + " ".join(cmd) + "\n")
+        log.flush()
+        proc = subprocess.run(
+            cmd,
+            cwd=cwd,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            preexec_fn=set_affinity,
+        )
+    return proc.returncode
+
+
+def run_worker(worker_idx: int, jobs, cpus, args) -> None:
+    work_dir = os.path.join(args.save_dir, "_farm")
+    log_file = os.path.join(work_dir, f"worker_{worker_idx}.log")
+    print(f"worker {worker_idx}: {len(jobs)} jobs on cpus {cpus}")
+
+    # all showreel jobs of a shard go through one blender process (batch mode)
+    showreel_jobs = [job for job in jobs if "script" not in job]
+    if showreel_jobs:
+        shard_manifest = os.path.join(work_dir, f"worker_{worker_idx}.jsonl")
+        with open(shard_manifest, "w") as f:
+            for job in showreel_jobs:
+                f.write(json.dumps(job) + "\n")
+        script_args = ["--manifest", shard_manifest, "--save_dir", args.save_dir]
+        if args.config:
+            script_args += ["--config", args.config]
+        cmd = blender_command(args.blender, len(cpus), SHOWREEL_SCRIPT, script_args)
+        retc = run_blender(cmd, cpus, log_file)
+        if retc != 0:
+            print(f"worker {worker_idx}: showreel batch exited with {retc}, see {log_file}")
+
+    # scripts/* renderers are standalone programs, one process per job
+    for job in jobs:
+        if "script" not in job:
+            continue
+        script = os.path.abspath(job["script"])
+        job_dir = job["save_dir"]
+        os.makedirs(job_dir, exist_ok=True)
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.dirname(script)
+        cmd = blender_command(args.blender, len(cpus), script, use_system_env=True)
+        retc = run_blender(cmd, cpus, log_file, cwd=job_dir, env=env)
+        if retc == 0:
+            rjobs.mark_job_done(job_dir, {"script": script})
+        else:
+            print(f"worker {worker_idx}: {script} exited with {retc}, see {log_file}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Shard render jobs across headless blender processes",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        required=True,
+        help="json/jsonl list of model files, scripts/*.py files or job dicts",
+    )
+    parser.add_argument("--save_dir", type=str, required=True, help="Output folder")
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=None,
+        help="json file overriding the default showreel config",
+    )
+    parser.add_argument("--workers", type=int, default=4, help="Blender processes")
+    parser.add_argument("--blender", type=str, default="blender", help="Blender binary")
+    parser.add_argument(
+        "--frame_chunks",
+        type=int,
+        default=1,
+        help="Split each showreel turntable into this many frame ranges",
+    )
+    parser.add_argument(
+        "--node_index",
+        type=int,
+        default=0,
+        help="Index of this node when several nodes share --save_dir",
+    )
+    parser.add_argument("--num_nodes", type=int, default=1, help="Nodes sharing --save_dir")
+
+    args = parser.parse_args()
+    args.save_dir = os.path.abspath(args.save_dir)
+    base_config = {}
+    if args.config:
+        args.config = os.path.abspath(args.config)
+        with open(args.config) as f:
+            base_config = json.load(f)
+    os.makedirs(os.path.join(args.save_dir, "_farm"), exist_ok=True)
+
+    jobs = rjobs.load_manifest(args.manifest)
+    for job in jobs:
+        job["save_dir"] = os.path.abspath(rjobs.job_dir(job, args.save_dir))
+        if "model_file" in job and not mfd.is_manifold_path(job["model_file"]):
+            job["model_file"] = os.path.abspath(job["model_file"])
+
+    # a chunked job is rendered as one task per frame range and merged afterwards
+    tasks = []
+    chunked = []
+    for job in jobs:
+        if args.frame_chunks > 1 and "script" not in job:
+            job_config = {**base_config, **job}
+            assert "frames" in job_config, f"frames unknown for {job['name']}, set it in --config"
+            chunk_jobs = rjobs.split_job_frames(job, job_config["frames"], args.frame_chunks)
+            chunked.append((job, chunk_jobs, job_config.get("video", False)))
+            tasks += [chunk for chunk in chunk_jobs if not rjobs.is_job_done(job["save_dir"])]
+        else:
+            tasks.append(job)
+
+    # same assignment on every node, independent of what is already done
+    tasks = tasks[args.node_index :: args.num_nodes]
+
+    # resume: skip everything a previous run already finished
+    pending = [task for task in tasks if not rjobs.is_job_done(task["save_dir"])]
+    print(f"{len(tasks) - len(pending)} of {len(tasks)} tasks already done")
+
+    if pending:
+        num_workers = min(args.workers, len(pending))
+        cpu_groups = rjobs.partition_cpus(num_workers)
+        shards = rjobs.shard_jobs(pending, num_workers)
+
+        with multiprocessing.Pool(num_workers) as pool:
+            pool.starmap(
+                run_worker,
+                [(k, shards[k], cpu_groups[k], args) for k in range(num_workers)],
+            )
+
+    for job, chunk_jobs, video in chunked:
+        if not rjobs.try_merge_frame_chunks(job, chunk_jobs, video):
+            print(f"{job['name']}: waiting for chunks from other nodes")
+
+    failed = [job["name"] for job in jobs if not rjobs.is_job_done(job["save_dir"])]
+    if failed:
+        print(f"{len(failed)} jobs not finished, re-run to resume: {failed}")
+        sys.exit(1)
+
+
+# python tools/render_farm.py --manifest=manifest.jsonl --save_dir=testdata/showreel/farm --workers=4
+# python tools/render_farm.py --manifest=manifest.jsonl --save_dir=testdata/showreel/farm --config=2k.json --frame_chunks=8 --node_index=0 --num_nodes=2